@@ -0,0 +1,243 @@
+import Riff_Generator as rg
+from itertools import product
+import argparse
+import json
+import numpy as np
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# benchmarks for the riff generator, run this file to print the results as JSON (or save them with --out)
+# every stage is timed on its own, over a fixed list of seeds and a grid of inputs, so two runs can be compared
+# python Riff_Benchmark.py --seeds 50 --out before.json
+# the transfer functions are cached (see CacheStats()), --cold empties the cache before every riff to time building them
+
+# the inputs that change how much work each stage does, everything else is left random (but seeded)
+defaultGrid = {'highestNote': [12, 24], 'howMuchCrazy': [0, 1], 'howManyChords': [2, 7]}
+
+######################## STAGES ########################
+# each riff goes through the stages in order (same as Main()), each one timed by itself
+# WriteMIDIFile is timed in memory (RenderMIDIFile()), the time to write to disk depends on the disk, not the code
+# Harmony is timed separately, once for every note and interval, since it's too quick to time one call
+
+stages = ['TransferFunction', 'MelodyTransferFunction', 'ChordsTransferFunction', 'RiffGenerator',
+          'WriteMIDIFile[midiutil]', 'WriteMIDIFile[fast]']
+
+def Stopwatch():
+    start = time.perf_counter()
+    return lambda: time.perf_counter() - start
+
+def MemoryWatch():
+    # the peak memory (in bytes) used on top of what was already in use when it started (tracemalloc must be on)
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    return lambda: tracemalloc.get_traced_memory()[1] - start
+
+def RunStages(session, point, measure=Stopwatch, cold=False):
+    # runs one riff through every stage, returns what measure() measured for each stage and how many notes the riff has
+    results = {}
+    if cold:
+        rg.ClearCache()
+    session.CreateMIDIFile()
+    session.RandomiseInputs(**point)
+    for stage in ['TransferFunction', 'MelodyTransferFunction', 'ChordsTransferFunction']:
+        stop = measure()
+        getattr(session, stage)()
+        results[stage] = stop()
+    session.RiffLengthRandom()
+    stop = measure()
+    session.RiffGenerator()
+    results['RiffGenerator'] = stop()
+    events = session.Events()
+    for backend in ['midiutil', 'fast']:
+        session.backend = backend
+        stop = measure()
+        session.RenderMIDIFile()
+        results['WriteMIDIFile[%s]' % backend] = stop()
+    return results, len(events)
+
+def PeakMemory(session, point, cold=False):
+    tracemalloc.start()
+    try:
+        return RunStages(session, point, MemoryWatch, cold)[0]
+    finally:
+        tracemalloc.stop()
+
+def Summary(seconds, notes=None, memory=None):
+    seconds = np.array(seconds)
+    summary = {'calls': len(seconds),
+               'riffsPerSecond': len(seconds) / seconds.sum(),
+               'latencyMicroseconds': {'mean': seconds.mean() * 1e6,
+                                       'p50': np.percentile(seconds, 50) * 1e6,
+                                       'p90': np.percentile(seconds, 90) * 1e6,
+                                       'p99': np.percentile(seconds, 99) * 1e6,
+                                       'max': seconds.max() * 1e6}}
+    if notes is not None:
+        summary['notesPerSecond'] = sum(notes) / seconds.sum()
+    if memory is not None:
+        summary['peakMemoryBytes'] = int(max(memory))
+    return summary
+
+def BenchmarkStages(seeds=20, grid=None, memorySeeds=3, cold=False):
+    # every seed at every point of the grid, timed with perf_counter, then peak memory for the first few seeds
+    # (tracemalloc slows everything down, so memory is measured in a separate pass)
+    grid = defaultGrid if grid is None else grid
+    points = [dict(zip(grid, values)) for values in product(*grid.values())]
+    times = {stage: [] for stage in stages}
+    memory = {stage: [] for stage in stages}
+    notes = []
+    byPoint = []
+    for point in points:
+        pointTimes = {stage: [] for stage in stages}
+        for seed in range(seeds):
+            stageTimes, riffNotes = RunStages(rg.RiffSession(seed), point, cold=cold)
+            notes.append(riffNotes)
+            for stage in stages:
+                times[stage].append(stageTimes[stage])
+                pointTimes[stage].append(stageTimes[stage])
+        for seed in range(min(memorySeeds, seeds)):
+            for stage, peak in PeakMemory(rg.RiffSession(seed), point, cold).items():
+                memory[stage].append(peak)
+        byPoint.append({'inputs': point,
+                        'meanMicroseconds': {stage: float(np.mean(pointTimes[stage]) * 1e6) for stage in stages}})
+    noteStages = ['RiffGenerator', 'WriteMIDIFile[midiutil]', 'WriteMIDIFile[fast]']
+    results = {stage: Summary(times[stage], notes if stage in noteStages else None, memory[stage]) for stage in stages}
+    results['Harmony'] = BenchmarkHarmony()
+    return {'stages': results, 'byPoint': byPoint}
+
+def BenchmarkHarmony(repeats=200):
+    calls = [(note, interval) for note in rg.keyScale for interval in rg.harmonyTable]
+    seconds = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        for note, interval in calls:
+            rg.Harmony(note, interval)
+        seconds.append((time.perf_counter() - start) / len(calls))
+    summary = Summary(seconds)
+    del summary['riffsPerSecond']
+    summary['callsPerSecond'] = 1 / np.mean(seconds)
+    summary['calls'] = repeats * len(calls)
+    return summary
+
+######################## LOOP COUNTERS ########################
+# what RiffGenerator()'s loop does at each point of the grid (see LoopCounters), averaged per riff
+# wasted is the passes that did nothing, the inputs with a lot of those are slow for no reason
+
+def CountLoops(seeds=20, grid=None):
+    grid = defaultGrid if grid is None else grid
+    byPoint = []
+    for values in product(*grid.values()):
+        point = dict(zip(grid, values))
+        counters = rg.LoopCounters()
+        for seed in range(seeds):
+            rg.RiffSession(seed, counters=counters).SetupRepeat(point).RiffGenerator()
+        byPoint.append({'inputs': point,
+                        'perRiff': {name: total / counters.riffs for name, total in counters.totals.items()},
+                        'sections': {section: hits / counters.riffs for section, hits in counters.sections.items()}})
+    return byPoint
+
+######################## MIDI BACKENDS ########################
+# the same events written by both MIDI backends (see midiBackend in Riff_Generator.py)
+# also checks the bytes are the same, the fast encoder is only worth having if they are
+
+def BenchmarkEncoders(riffs=600, seed=0):
+    batch = rg.generate_batch(-(-riffs // 3), workers=1, seed=seed)
+    results = {'riffs': len(batch)}
+    outputs = {}
+    for backend in ['midiutil', 'fast']:
+        start = time.perf_counter()
+        outputs[backend] = [rg.RenderMIDI(riff.events, backend=backend) for riff in batch]
+        seconds = time.perf_counter() - start
+        results[backend] = {'riffsPerSecond': len(batch) / seconds, 'secondsPerRiff': seconds / len(batch)}
+    results['identical'] = outputs['midiutil'] == outputs['fast']
+    results['speedup'] = results['fast']['riffsPerSecond'] / results['midiutil']['riffsPerSecond']
+    return results
+
+######################## ENGINES ########################
+# RiffGenerator() one riff at a time vs LockstepRiffs() for the whole batch, on the same set up sessions
+# only the riff generating loop is timed (and building the events), not setting up the sessions or writing MIDI
+
+def BenchmarkEngines(repeats=1000, songParts=3, seed=0):
+    sessions = [rg.RiffSession(child).SetupRepeat() for child in np.random.SeedSequence(seed).spawn(repeats)]
+    results = {'riffs': repeats * songParts}
+    start = time.perf_counter()
+    for session in sessions:
+        for j in range(songParts):
+            session.CreateMIDIFile()
+            session.RiffGenerator()
+            session.Events()
+    results['session'] = {'riffsPerSecond': repeats * songParts / (time.perf_counter() - start)}
+    start = time.perf_counter()
+    rg.LockstepRiffs(sessions, songParts, np.random.default_rng(seed))
+    results['lockstep'] = {'riffsPerSecond': repeats * songParts / (time.perf_counter() - start)}
+    results['speedup'] = results['lockstep']['riffsPerSecond'] / results['session']['riffsPerSecond']
+    return results
+
+######################## IMPORT TIME ########################
+# a short job (one riff, or a worker that only writes a few) spends most of its time importing, so that's timed too:
+# python -X importtime in a fresh process, which times every module that gets imported (after one run to warm up)
+# the result is the median of the runs, for Riff_Generator and everything it imports directly
+# importBudget is the most importing Riff_Generator should take (most of it is numpy, pandas should never be imported)
+
+importBudget = 200000       # microseconds
+
+def ImportTimes(folder, module):
+    # how long importing module took, and each module it imported itself (cumulative microseconds)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=folder,
+                            capture_output=True, text=True, check=True)
+    lines = []
+    for line in result.stderr.splitlines():
+        fields = line.replace('import time:', '').split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            lines.append((fields[2][1:].rstrip(), int(fields[1])))     # indented 2 spaces for every level deeper
+    end = [name for name, microseconds in lines].index(module)
+    imports = {}
+    for name, microseconds in reversed(lines[:end]):        # what a module imports comes just before it
+        if not name.startswith(' '):
+            break
+        if not name.startswith('   '):
+            imports[name.strip()] = microseconds
+    return lines[end][1], imports, any(name.strip() == 'pandas' for name, microseconds in lines)
+
+def BenchmarkImport(repeats=5):
+    folder, module = os.path.split(os.path.splitext(os.path.abspath(rg.__file__))[0])
+    ImportTimes(folder, module)
+    runs = [ImportTimes(folder, module) for i in range(repeats)]
+    total = float(np.median([microseconds for microseconds, imports, pandas in runs]))
+    names = sorted({name for microseconds, imports, pandas in runs for name in imports})
+    return {'microseconds': total,
+            'budgetMicroseconds': importBudget,
+            'withinBudget': total <= importBudget,
+            'pandasImported': any(pandas for microseconds, imports, pandas in runs),
+            'imports': {name: float(np.median([imports.get(name, 0) for microseconds, imports, pandas in runs]))
+                        for name in names}}
+
+######################## ALL OF IT ########################
+
+def Benchmark(seeds=20, grid=None, encoderRiffs=600, cold=False):
+    results = {'python': platform.python_version(), 'numpy': np.__version__, 'seeds': seeds,
+               'grid': defaultGrid if grid is None else grid, 'cold': cold}
+    rg.ClearCache()
+    results.update(BenchmarkStages(seeds, grid, cold=cold))
+    results['cache'] = rg.CacheStats()
+    results['loops'] = CountLoops(seeds, grid)
+    results['encoders'] = BenchmarkEncoders(encoderRiffs)
+    results['engines'] = BenchmarkEngines()
+    results['import'] = BenchmarkImport()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the riff generator stages, results are JSON")
+    parser.add_argument('--seeds', type=int, default=20, help="riffs per grid point (seeds 0 to seeds-1)")
+    parser.add_argument('--out', help="save the results here instead of printing them")
+    parser.add_argument('--cold', action='store_true', help="empty the transfer function cache before every riff")
+    args = parser.parse_args()
+    results = json.dumps(Benchmark(args.seeds, cold=args.cold), indent=2, default=float)
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(results)
+    else:
+        print(results)
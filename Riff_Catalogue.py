@@ -0,0 +1,54 @@
+import Riff_Generator as rg
+import argparse
+import os
+
+# look up riffs in a catalogue (see RiffCatalogue in Riff_Generator.py), or write them again as MIDI files
+# python Riff_Catalogue.py riffs.sqlite add 100                                  (generate_batch() 100 repeats into it)
+# python Riff_Catalogue.py riffs.sqlite find gallop-heavy "bars = 4" "chords <= 3"
+# python Riff_Catalogue.py riffs.sqlite render 12 40 --out riffs
+# the tags that can be used with find are in catalogueTags, anything else is 'column op value'
+
+# the columns find prints, every column can be used in a condition
+shown = ['id', 'bars', 'chords', 'chordSet', 'notes', 'pmRatio', 'chordRatio', 'melodyRatio', 'restRatio', 'gallopRatio']
+
+def PrintRiffs(rows):
+    print("\t".join(shown))
+    for row in rows:
+        print("\t".join("%.2f" % row[name] if isinstance(row[name], float) else str(row[name]) for name in shown))
+
+def RenderRiffs(catalogue, ids, out):
+    os.makedirs(out, exist_ok=True)
+    for id in ids:
+        riff = catalogue.Render(id)
+        name = os.path.join(out, rg.RiffFilename(riff.bars, riff.chords, id, riff.midi))
+        with open(name, 'wb') as f:
+            f.write(riff.midi)
+        print(name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="find riffs in a riff catalogue, or write them again from their seeds")
+    parser.add_argument('catalogue', help="the catalogue's SQLite file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="generate a batch of riffs and record them")
+    add.add_argument('repeats', type=int)
+    add.add_argument('--seed', type=int)
+    add.add_argument('--engine', default='session', choices=['session', 'lockstep'])
+    find = commands.add_parser('find', help="print the riffs that meet every condition")
+    find.add_argument('conditions', nargs='*', help="tags (%s) or conditions like 'bars = 4'" % ", ".join(rg.catalogueTags))
+    find.add_argument('--limit', type=int)
+    render = commands.add_parser('render', help="write riffs again from their seeds")
+    render.add_argument('ids', type=int, nargs='+')
+    render.add_argument('--out', default='.', help="the folder to write the MIDI files to")
+    args = parser.parse_args()
+
+    catalogue = rg.RiffCatalogue(args.catalogue)
+    try:
+        if args.command == 'add':
+            rg.generate_batch(args.repeats, seed=args.seed, engine=args.engine, catalogue=catalogue)
+            print(len(catalogue), "riffs in", args.catalogue)
+        elif args.command == 'find':
+            PrintRiffs(catalogue.Find(*args.conditions, limit=args.limit))
+        else:
+            RenderRiffs(catalogue, args.ids, args.out)
+    finally:
+        catalogue.Close()
@@ -2,15 +2,22 @@ from midiutil.MidiFile import MIDIFile
 # https://github.com/MarkCWirt/MIDIUtil
 # https://midiutil.readthedocs.io/en/latest/
 import numpy as np
-import pandas as pd
-from datetime import datetime
-
-pd.set_option('precision',3)
+from dataclasses import dataclass
+from collections import deque
+from functools import lru_cache
+from itertools import product
+import bisect
+import hashlib
+import io
+import os
+from time import perf_counter
+# everything else is imported in the functions that need it (pandas, asyncio, process pools, archives...),
+# most runs never use them and importing them takes longer than writing a riff (see BenchmarkImport())
 
 ######################### settings ########################
 
 # initial settings
-time = 0            # GLOBAL TIME VARIABLE!!!!! In beats (1/4 notes), needs to reinitialise every run when looping
+# (time is kept by each RiffSession, in beats (1/4 notes), and starts again from 0 with every new MIDI file)
 tempo = 140
 djent = 1/4         # smallest increment of notes, quarter quarter note = 1/16 note
 key = 33            # ROOT NOTE IN MIDI (7-string drop-A tuning is 33 (55 Hz), low E standard guitar is 40 (~82.4 Hz))
@@ -33,36 +40,9 @@ track = 0       # the main track
 # annotations are added if MIDI is sent to notation software, denoted "PM" (see functions section below)
 PMtrack = 1
 
-def CreateMIDIFile():
-    global mf
-    global time
-    time = 0                # start at the beginning
-    mf = MIDIFile(1 + PMtrack)      # only 1 track unless PMtrack is used
-    mf.addTempo(track, time, tempo)
-    mf.addTempo(PMtrack, time, tempo)   # not needed for format 1 midi (default)
-    # mf.addTrackName(track, time, "Sample Track") # use if you need to name the track
-
-######################## INPUTS TO RANDOMISE ########################
-# inputs that are used in the riff generation function, ranges are typically
-# change the high and low range to change the output style
-# typically ratings out of 10 (to be normalised later), but are not actually restricted to 10
-# try extreme values at your own risk (also, negative values probably break stuff)
-
-def RandomiseInputs():
-    global howMuchCrazy
-    global howManyChords
-    global highestNote
-    global howMuchPM
-    global howMuchCHORDS
-    global howMuchMELODY
-    global howMuchREST
-    howMuchCrazy = np.random.randint(0,2)           # how likly the pattern is to not follow the flowchart
-    howManyChords = np.random.randint(2,8)          # how many chords in chord progression transfer matrix
-    highestNote = np.random.choice([12,13,14,15,17,18,19,20,22,23,24])      # highest note available (note must be in keyScale below)
-    howMuchPM = np.random.randint(3,9)              # int out of 10, a priority (not actually restricted to 10)
-    howMuchCHORDS = np.random.randint(3,9)          # int out of 10, a priority
-    howMuchMELODY = np.random.randint(3,9)          # int out of 10, a priority
-    howMuchREST = np.random.randint(0,4)            # int out of 10, a priority
+# how the MIDI files are written: 'midiutil' (MIDIFile.addNote for every note), or 'fast' to encode the notes
+# straight into MIDI bytes with numpy (same bytes, see EncodeMIDI()), can also be chosen per RiffSession
+midiBackend = 'midiutil'
 
 ######################## chord harmonies ########################
 
@@ -73,9 +53,33 @@ keyHarmony7 = [7,8,10,10,12,13,14,15,17,18,19,20,22,22,24,25,26,27,29,30,31]   #
 keyHarmony3 = [3,5,5,7,8,10,10,12,14,14,15,17,17,19,20,22,22,24,26,26,27]      # 3rd from above scale (3 or 4 notes above)
 keyScale = [0,1,2,3,5,6,7,8,10,11,12,13,14,15,17,18,19,20,22,23,24]  
 
-kHarm7 = pd.DataFrame(keyHarmony7)
-kHarm3 = pd.DataFrame(keyHarmony3)
-kScale = pd.DataFrame(keyScale)
+# compiled into a direct lookup, one dense row per interval, indexed by the note (semitones above key)
+# notes that aren't in keyScale just get note + interval
+# to add another interval (4ths, octaves...) write its scale like the two above and call AddHarmony()
+# e.g. AddHarmony(12, [note + 12 for note in keyScale])
+harmonyTable = {}
+
+def AddHarmony(interval, keyHarmony):
+    harmonies = np.arange(keyScale[-1] + 1) + interval
+    harmonies[keyScale] = keyHarmony
+    harmonyTable[interval] = harmonies
+
+AddHarmony(3, keyHarmony3)
+AddHarmony(7, keyHarmony7)
+
+def Harmony(note,interval):
+    if interval in harmonyTable:
+        return int(harmonyTable[interval][note])
+    return note + interval
+
+def Harmonies(notes,intervals):
+    # same as Harmony(), but for arrays of notes and intervals
+    harmonies = notes + intervals
+    for interval in set(intervals.tolist()):         # not np.unique, it imports numpy.ma the first time
+        if interval in harmonyTable:
+            sel = intervals == interval
+            harmonies[sel] = harmonyTable[interval][notes[sel]]
+    return harmonies
 
 ######################## generate the main transfer function ########################
 
@@ -95,8 +99,7 @@ p = 0               # probability of all other transfers
 # better chord progressions and note intervals are more likely
 # it should end up sounding better than a random walk
 
-def TransferFunction():
-    global tf
+def TransferFunction(highestNote, howMuchCrazy):
 
     # this is cut and paste from Excel, easier to draw harmony shapes in Excel
     tfDATA = {
@@ -122,28 +125,30 @@ def TransferFunction():
     '23': [0,0,0,0,0,0,0,0,0,p,p,p,p,p,p,p,p,p,p,stay,p],
     '24': [0,0,0,0,0,0,0,0,0,0,p,p,p,p,p,m,p,p,p,m,stay]}
 
-    tf1 = pd.DataFrame(data = tfDATA,
-    columns = ['0', '1', '2', '3', '5', '6', '7', '8', '10', '11', '12', '13', '14', '15', '17', '18', '19', '20', '22', '23', '24'],
-    index = ['0', '1', '2', '3', '5', '6', '7', '8', '10', '11', '12', '13', '14', '15', '17', '18', '19', '20', '22', '23', '24'])
-    # print(tf1) # looks good, rows and columns get swapped, but that is correct
+    notes = np.array([int(note) for note in tfDATA])
+    tf1 = np.array(list(tfDATA.values()), dtype=float).T
+    # print(TransferTable(notes, tf1)) # looks good, rows and columns get swapped, but that is correct
     # Note: rows/indices should sum to zero, handled later in calculation
+    if markovChains is not None:        # chains from UseMarkov() instead
+        notes, tf1 = MarkovTable('tf')
 
     # delete rows and columns above highest note
-    tf2 = tf1.loc['0':str(highestNote),'0':str(highestNote)]
+    keep = np.count_nonzero(notes <= highestNote)
+    tf2 = tf1[:keep, :keep]
     # add crazy
     tf3 = tf2 + howMuchCrazy
+    CheckRows(notes[:keep], tf3, 'the main transfer function', highestNote)
     # normalise probabilities in tf, rows/index must sum to 1.0
-    tf = (tf3.T / tf3.sum(axis=1)).T
-    # don't know why I couldn't get this to work without transposing using axis=0, but this works, so I kept it
+    tf = tf3 / tf3.sum(axis=1, keepdims=True)
 
     ######################## MAIN TRANSFER FUNCTION ########################
-    # print(tf)
+    # print(TransferTable(notes[:keep], tf))
+    return notes[:keep], tf
 
 ######################## generate the melody transfer function ########################
 # similarly, but for the melody / lead functions (single notes)
 
-def MelodyTransferFunction():
-    global mtf
+def MelodyTransferFunction(highestNote, howMuchCrazy):
 
     # this is cut and paste from Excel, easier to draw harmony shapes in Excel
     mtfDATA = {
@@ -169,307 +174,1021 @@ def MelodyTransferFunction():
     '23': [0,0,0,0,0,0,0,0,0,h,p,p,p,p,p,p,p,p,p,h,p],
     '24': [0,0,0,0,0,0,0,0,0,0,h,p,p,p,p,m,p,p,p,m,h]}
 
-    mtf1 = pd.DataFrame(data = mtfDATA,
-    columns = ['0', '1', '2', '3', '5', '6', '7', '8', '10', '11', '12', '13', '14', '15', '17', '18', '19', '20', '22', '23', '24'],
-    index = ['0', '1', '2', '3', '5', '6', '7', '8', '10', '11', '12', '13', '14', '15', '17', '18', '19', '20', '22', '23', '24'])
+    notes = np.array([int(note) for note in mtfDATA])
+    mtf1 = np.array(list(mtfDATA.values()), dtype=float).T
+    if markovChains is not None:
+        notes, mtf1 = MarkovTable('mtf')
 
     # delete rows and columns above highest note
-    mtf2 = mtf1.loc['0':str(highestNote),'0':str(highestNote)]
+    keep = np.count_nonzero(notes <= highestNote)
+    mtf2 = mtf1[:keep, :keep]
     # add crazy
     mtf3 = mtf2 + howMuchCrazy
-    # normalise probabilities 
-    mtf = (mtf3.T / mtf3.sum(axis=1)).T
+    CheckRows(notes[:keep], mtf3, 'the melody transfer function', highestNote)
+    # normalise probabilities
+    mtf = mtf3 / mtf3.sum(axis=1, keepdims=True)
 
     ######################## melody transfer function ########################
-    # print(mtf)
-
-######################## CHORDS ########################
-# this function limits the number of chords in the scale
-# it starts on the root note (the root chord is always included)
-# and follows the transfer function through n = howManyChords
-
-def ChordsTransferFunction():
-    global ct
-    global chordsInKey
-    chordsInKey = []
-    chordsInKey.append(tf.iloc[0].index[0])  # always include tonic in chords
-    chordsInKey
-    newChord = '0'   # initialise newChord
-
-    while len(chordsInKey) < howManyChords:
-        newChord = np.random.choice(tf.iloc[tf.index.get_loc(newChord)].index, p = tf.iloc[tf.index.get_loc(newChord)])
-        if newChord not in chordsInKey:
-            chordsInKey.append(newChord)
-        
-    chordsInKey  # chords to be used in the chord transfer function
-
-    # delete all other chords and re-normalise as a new dataframe
-    chordTransitions = tf.loc[chordsInKey,chordsInKey]
-    ct = (chordTransitions.T / chordTransitions.sum(axis=1)).T   # re-normalise
-
-######################## CHORD PROGRESSION TRANSFER FUNCTION ########################
-# print(ct)   # order doesn't matter
-
-######################## FUNCTIONS ########################
-# here are all of the musical building blocks used in the riff generation engine
+    # print(TransferTable(notes[:keep], mtf))
+    return notes[:keep], mtf
 
-def Harmony(note,interval):
-    harmony = note + interval
-    if interval == 3:
-        harmony = int(kHarm3.iloc[int(kScale.loc[kScale.isin([note]).any(axis=1)].index[0])][0])
-    elif interval == 7:
-        harmony = int(kHarm7.iloc[int(kScale.loc[kScale.isin([note]).any(axis=1)].index[0])][0])
-    return harmony
-
-def Chord(note,interval,length):   # length in beats
-    global time                 # so time is never explicit
-    pitch = key + note
-    pitch2 = key + Harmony(note,interval)
-    volume = chordPick
-    mf.addNote(track, channel, pitch, time, length, volume)
-    mf.addNote(track, channel, pitch2, time, length, volume)
-    time += length
-    
-def Note(note,length):
-    global time                 # so time is never explicit
-    pitch = key+note
-    volume = chordPick
-    mf.addNote(track, channel, pitch, time, length, volume)
-    time += length
-    
-def Rest(length):
-    global time
-    time += length
-    
-def DownPM(note):
-    global time                 # so time is never explicit
-    pitch = key+note            # randomise whether this used note or not
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 2/4, djent, downPick, annotation="PM")
-    time += 1
-    
-def UpDown(note):
-    global time                 # so time is never explicit
-    pitch = key+note            # randomise whether this used note or not
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 1/4, djent, upPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 2/4, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 3/4, djent, upPick, annotation="PM")
-    time += 1
-
-def Gallop(note):
-    global time                 # so time is never explicit
-    pitch = key+note            # randomise whether this used note or not
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 2/4, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 3/4, djent, upPick, annotation="PM")
-    time += 1
-
-def RevGallop(note):
-    global time                 # so time is never explicit
-    pitch = key+note            # randomise whether this used note or not
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 1/4, djent, upPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 2/4, djent, downPick, annotation="PM")
-    time += 1
-    
-############ if you would prefer a specific PM pattern, you could modify this function (change odds to 0 or 1) ############
-def PalmMute(note):
-    if np.random.random() < 0.25:
-        Gallop(note)
-    elif np.random.random() < 0.25:
-        RevGallop(note)
-    elif np.random.random() < 0.25:
-        UpDown(note)
-    else:
-        DownPM(note)
-        
-def UpDownSHORT(note):
-    global time                 # so time is never explicit
-    pitch = key+note            # randomise whether this used note or not
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch, time + 1/4, djent, upPick, annotation="PM")
-    time += 1/2
-    
-def PMChordSHORT(note,interval):   # length in beats
-    global time                 # so time is never explicit
-    pitch = key + note
-    pitch2 = key + Harmony(note,interval)
-    mf.addNote(PMtrack, channel, pitch, time, djent, downPick, annotation="PM")
-    mf.addNote(PMtrack, channel, pitch2, time, djent, downPick, annotation="PM")
-    time += 1/2
-        
-def PalmMuteSHORT(note,interval):
-    if np.random.random() < 0.5:
-        UpDownSHORT(note)
-    else:
-        PMChordSHORT(note,interval)
+######################## CHECKING TRANSFER FUNCTIONS ########################
+# a transfer function cut down to highestNote can end up with notes that don't go anywhere (every weight from them
+# is 0), or fewer notes that can be reached from the root than howManyChords, then the probabilities are NaN or
+# ChordsTransferFunction() never finds enough chords, so those are errors instead
+# (the pasted in ones are fine, UseMarkov() checks new ones for every highestNote RandomiseInputs() can pick)
+
+def CheckRows(notes, transitions, name, highestNote):
+    # transitions has a row of weights from each note
+    empty = transitions.sum(axis=1) <= 0
+    if empty.any():
+        raise ValueError("%s has no way out of notes %s with highestNote %d (all the weights from them are 0)"
+                         % (name, notes[empty].tolist(), highestNote))
+
+def Reachable(transitions):
+    # how many notes can be got to from the root (row 0), following the weights that aren't 0
+    reached = np.zeros(len(transitions), dtype=bool)
+    reached[0] = True
+    while True:
+        more = reached | (transitions[reached] > 0).any(axis=0)
+        if (more == reached).all():
+            return int(reached.sum())
+        reached = more
+
+######################## COMPILED TRANSFER FUNCTIONS ########################
+# the transfer functions are plain numpy arrays (the notes, and the probabilities with a row for each note)
+# the riff engine draws from them compiled into:
+# notes: the note (semitones above key) for each row/column, as ints
+# cdf: cumulative probabilities along each row, so a transition is one uniform draw and a binary search
+# noteIndex: dense lookup from a note to its row (-1 if the note isn't in the transfer function)
+# this is the same thing np.random.choice does internally, so the riffs don't change (same seed, same riff)
+# they used to be pandas DataFrames, TransferTable() still makes one to print or save (the only thing that needs pandas)
+
+def TransferTable(notes, transitions):
+    import pandas as pd         # only imported when it's needed, it takes longer to import than writing a riff
+    labels = [str(note) for note in notes]
+    return pd.DataFrame(transitions, index=labels, columns=labels)
+
+def CompileTransitions(notes, transitions):
+    cdf = transitions.cumsum(axis=1)
+    cdf /= cdf[:, -1:]          # last column is exactly 1.0, same as np.random.choice
+    noteIndex = np.full(keyScale[-1] + 1, -1)
+    noteIndex[notes] = np.arange(len(notes))
+    return notes, cdf, noteIndex
+
+######################## TRANSFER FUNCTION CACHE ########################
+# RandomiseInputs() only has 11 highestNotes x 2 howMuchCrazys, so the same transfer functions get built over and over
+# these keep the most recently used ones (already compiled), and the chord transfer functions for each set of chords
+# everything in the cache is shared between sessions, so the arrays are read only
+# CacheStats() shows how well it's working (hits, misses, how full it is)
 
-######################## RIFF GENERATING ENGINE ########################
+def ReadOnly(compiled):
+    for array in compiled:
+        array.setflags(write=False)
+    return compiled
 
-############ if you want a specific length, you could modify this function or sett all the attributes equal above ############
-def RiffLengthRandom():
-    global riffLength
-    if np.random.random() < 1/3:
-        riffLength = riffLengthMin
-    elif np.random.random() < 1/2:
-        riffLength = riffLengthMed   
+@lru_cache(maxsize=64)
+def CompiledTransferFunction(highestNote, howMuchCrazy):
+    notes, tf = TransferFunction(highestNote, howMuchCrazy)
+    return ReadOnly(CompileTransitions(notes, tf) + (tf,))
+
+@lru_cache(maxsize=64)
+def CompiledMelodyTransferFunction(highestNote, howMuchCrazy):
+    notes, mtf = MelodyTransferFunction(highestNote, howMuchCrazy)
+    return ReadOnly(CompileTransitions(notes, mtf) + (mtf,))
+
+@lru_cache(maxsize=4096)
+def CompiledChordsTransferFunction(highestNote, howMuchCrazy, chordsInKey):
+    # chordsInKey is a tuple, in the order the chords were picked (row 0 is always the root)
+    # there are too many sets of chords for the cache to catch most of them, so this is done with the compiled tf
+    tfNotes, tfCDF, tfIndex, tfProbabilities = CompiledTransferFunction(highestNote, howMuchCrazy)
+    notes = np.array([int(chord) for chord in chordsInKey])
+    rows = tfIndex[notes]
+    # delete all other chords and re-normalise
+    chordTransitions = tfProbabilities[np.ix_(rows, rows)]
+    ct = chordTransitions / chordTransitions.sum(axis=1, keepdims=True)
+    cdf = ct.cumsum(axis=1)
+    cdf /= cdf[:, -1:]
+    noteIndex = np.full(keyScale[-1] + 1, -1)
+    noteIndex[notes] = np.arange(len(notes))
+    return ReadOnly((notes, cdf, noteIndex))
+
+@lru_cache(maxsize=64)
+def ReachableChords(highestNote, howMuchCrazy):
+    return Reachable(CompiledTransferFunction(highestNote, howMuchCrazy)[3])
+
+def CacheStats():
+    stats = {}
+    for cache in [CompiledTransferFunction, CompiledMelodyTransferFunction, CompiledChordsTransferFunction]:
+        info = cache.cache_info()
+        stats[cache.__name__] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+    return stats
+
+def ClearCache():
+    # needed if stay, h, m, p or the scales are changed after riffs have been written
+    CompiledTransferFunction.cache_clear()
+    CompiledMelodyTransferFunction.cache_clear()
+    CompiledChordsTransferFunction.cache_clear()
+    ReachableChords.cache_clear()
+
+######################## LOADING CHAINS AND SCALES ########################
+# the transfer functions above are pasted from music markov.xlsx, UseMarkov() swaps in different ones (and scales) from
+# - a workbook laid out like that one: sheets 'main transfer function' and 'melody tf', each with the notes across
+#   the top ('from') and down the side ('to'), and optionally a sheet 'scales' with a row each for
+#   keyHarmony3 and keyHarmony7 (the name, then the notes)
+# - a folder of those sheets saved as CSV: main transfer function.csv, melody tf.csv (and scales.csv)
+# - a JSON file: {"keyScale": [...], "keyHarmony3": [...], "keyHarmony7": [...], "tf": [[...], ...], "mtf": [[...], ...]}
+#   with one list per 'to' note, the same as the lists in TransferFunction()
+# weights are numbers, or 'stay', 'h', 'm' or 'p' to use those weights (so they can still be changed after loading)
+# keyScale is the notes of the transfer functions, the harmonies are the ones above unless the source has its own
+# reading a workbook is slow, so the checked and compiled arrays are saved next to the source (source + '.npz')
+# and loaded from there until the source changes, or markovCacheVersion does
+
+markovSheets = {'tf': 'main transfer function', 'mtf': 'melody tf', 'scales': 'scales'}
+markovSymbols = ['stay', 'h', 'm', 'p']     # symbol 1 is stay, 2 is h... (0 is a number)
+markovCacheVersion = 1
+markovChains = None         # the arrays from UseMarkov(), None for the ones pasted in above
+markovSource = None
+pastedScales = (keyScale, keyHarmony3, keyHarmony7)
+
+def IsNumber(cell):
+    try:
+        float(cell)
+        return cell is not None and cell != ''
+    except (TypeError, ValueError):
+        return False
+
+def SheetTable(grid, name):
+    # the table in a sheet (a list of rows of cells): the first row with notes in it is the top row,
+    # the column before the first note has the notes down the side, and the table ends at the first row without one
+    # returns the notes across the top, the notes down the side, and the cells in between
+    for top, row in enumerate(grid):
+        if sum(IsNumber(cell) for cell in row) >= 2:
+            break
     else:
-        riffLength = riffLengthMax
-
-def RiffGenerator():
-    # inputs and initialisation
-
-    currentChord = '0'
-    palmMuteNote = '0'
-    currentNoteLength = 1/2
-    currentNote = '0'
-
-    howMuch = howMuchPM + howMuchCHORDS + howMuchMELODY + howMuchREST
-    pm = howMuchPM / howMuch
-    ch = howMuchCHORDS / howMuch
-    ml = howMuchMELODY / howMuch
-    rs = howMuchREST / howMuch
-
-    # when doing something, more likely to keep doing that
-    # stickinessFactor = 2
-    pmCURRENT = 1
-    chCURRENT = 1
-    mlCURRENT = 1
-
-    # internal probabilites of variation within sections of the while loop
-    # to modify these, you'll need to spend time looking at the loop in detail
-    # there is probably a better way to parameterise these, but this worked well enough
-    pPM = 0.5   # PM internal probability
-    pCH = 0.2   # Chords internal probability
-    pN = 0.3    # Melody / note internal probability
-
-######################## CALCULATION ########################
-# complicated nested whiles and ifs that follow my musical intuition about how to make a metal guitar riff
-# there is a stickiness factor at the end of each section, the odds are more likely that will happen again
-# the stickiness was a variable, but now it's a magic number because different values seem to work better for different sections
-# again, I could probably parameterise this better, but it is what it is
-
-    global riffLength
-    global time
-    while time < riffLength:
-        # markov chain to change chord
-        currentChord = np.random.choice(ct.iloc[ct.index.get_loc(currentChord)].index, p = ct.iloc[ct.index.get_loc(currentChord)])
-        currentInterval = 7
-        time = int(time * 2) / 2                  # correct rounding errors in time, only 1/8 notes
-        
-        # palm muting
-        if np.random.random() < pm * pmCURRENT:
-            if np.random.random() > pPM:
-                palmMuteNote = currentChord
-            else:
-                palmMuteNote = '0'
-            if time % 1 != 0:                      # should only be 1/2 or 1 unless rounding errors
-                PalmMuteSHORT(int(palmMuteNote),currentInterval)
-            else:
-                PalmMute(int(palmMuteNote))
-            pmCURRENT = 2
-            chCURRENT = 1
-            mlCURRENT = 1
-            
-        # chords
-        elif np.random.random() < ch * chCURRENT:
-            #chord length
-            if np.random.random() < pCH:
-                currentNoteLength = 1/2
-            elif np.random.random() < pCH:
-                currentNoteLength = 3/2
-            elif np.random.random() < pCH / 2:          # less chance of long chord
-                currentNoteLength = 2
-            else:
-                currentNoteLength = 1
-            # check how long is left, and correct to avoid overruns
-            if currentNoteLength > riffLength - time:
-                currentNoteLength = riffLength - time
-            
-            # change the chord interval randomly (mostly 5ths (7), but some 3rds)
-            if np.random.random() < pCH:
-                currentInterval = 3
-            else:
-                currentInterval = 7
-                        
-            if np.random.random() < pCH:             # PM chords
-                PMChordSHORT(int(currentChord),currentInterval)
-                if currentNoteLength >= 1:          # max of 2 PM chords in a row even with a longer chord, maybe fix this logic
-                    PMChordSHORT(int(currentChord),currentInterval)
-                    time += currentNoteLength - 1
+        raise ValueError("no table of notes in %s" % name)
+    first = next(i for i, cell in enumerate(row) if IsNumber(cell))
+    across = []
+    for cell in row[first:]:
+        if not IsNumber(cell):
+            break
+        across.append(int(float(cell)))
+    if first == 0:
+        raise ValueError("no column of notes down the side of the table in %s" % name)
+    down = []
+    cells = []
+    for row in grid[top + 1:]:
+        if len(row) < first or not IsNumber(row[first - 1]):
+            break
+        down.append(int(float(row[first - 1])))
+        cells.append((list(row[first:first + len(across)]) + [None] * len(across))[:len(across)])
+    return across, down, cells
+
+def SheetScales(grid):
+    scales = {}
+    for row in grid:
+        row = [cell for cell in row if cell not in (None, '')]
+        if row and str(row[0]).strip() in ['keyScale', 'keyHarmony3', 'keyHarmony7']:
+            scales[str(row[0]).strip()] = [int(float(cell)) for cell in row[1:]]
+    return scales
+
+def ReadMarkovSheets(sheets, name):
+    # sheets is the grid of each sheet (by sheet name) from a workbook or a folder of CSV files
+    markov = SheetScales(sheets.get(markovSheets['scales'], []))
+    for chain in ['tf', 'mtf']:
+        if markovSheets[chain] not in sheets:
+            raise ValueError("%s has no %r sheet" % (name, markovSheets[chain]))
+        across, down, cells = SheetTable(sheets[markovSheets[chain]], "%r in %s" % (markovSheets[chain], name))
+        if across != down:
+            raise ValueError("%r in %s isn't square, the notes across the top %s and down the side %s don't match"
+                             % (markovSheets[chain], name, across, down))
+        markov.setdefault('keyScale', across)
+        markov[chain] = cells
+    return markov
+
+def MarkovFiles(source):
+    # the files a source is read from (to tell when it's changed)
+    if os.path.isdir(source):
+        return [os.path.join(source, sheet + '.csv') for sheet in markovSheets.values()
+                if os.path.exists(os.path.join(source, sheet + '.csv'))]
+    return [source]
+
+def ReadMarkov(source):
+    # the scales and the cells of each transfer function, as they are in the source
+    if os.path.isdir(source):
+        import csv
+        sheets = {}
+        for path in MarkovFiles(source):
+            with open(path, newline='') as f:
+                sheets[os.path.splitext(os.path.basename(path))[0]] = list(csv.reader(f))
+        return ReadMarkovSheets(sheets, source)
+    if source.endswith('.json'):
+        import json
+        with open(source) as f:
+            return json.load(f)
+    if source.endswith('.xlsx'):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("reading %s needs openpyxl (pip install openpyxl), or save the sheets as CSV" % source)
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        try:
+            sheets = {sheet.title: [list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook}
+        finally:
+            workbook.close()
+        return ReadMarkovSheets(sheets, source)
+    raise ValueError("can't read %s, use a .xlsx or .json file or a folder of CSV files" % source)
+
+def MarkovWeights(numbers, symbols):
+    # the weights of a transfer function, with the current stay, h, m and p for the symbols
+    return np.where(symbols > 0, np.array([0, stay, h, m, p], dtype=float)[symbols], numbers)
+
+def CompileMarkov(markov, name):
+    # checks everything that was read, returns the arrays UseMarkov() uses (the same arrays the cache file holds)
+    for scale in ['keyScale', 'keyHarmony3', 'keyHarmony7']:
+        if scale not in markov:
+            markov[scale] = pastedScales[['keyScale', 'keyHarmony3', 'keyHarmony7'].index(scale)]
+    compiled = {scale: np.array(markov[scale]) for scale in ['keyScale', 'keyHarmony3', 'keyHarmony7']}
+    notes = compiled['keyScale']
+    if notes.ndim != 1 or notes.dtype.kind not in 'iu' or len(notes) < 2 or notes[0] != 0 or (np.diff(notes) <= 0).any():
+        raise ValueError("keyScale in %s must be whole notes going up from 0, not %s" % (name, markov['keyScale']))
+    for scale in ['keyHarmony3', 'keyHarmony7']:
+        if compiled[scale].shape != notes.shape or compiled[scale].dtype.kind not in 'iu' or (compiled[scale] < 0).any():
+            raise ValueError("%s in %s must be a whole note (0 or more) for each note in keyScale" % (scale, name))
+    for chain in ['tf', 'mtf']:
+        if chain not in markov:
+            raise ValueError("%s has no %r chain (the %s)" % (name, chain, markovSheets[chain]))
+        cells = markov[chain]
+        if len(cells) != len(notes) or any(len(row) != len(notes) for row in cells):
+            raise ValueError("%s in %s must be a square table with a row and column for each note in keyScale (%d)"
+                             % (chain, name, len(notes)))
+        numbers = np.zeros((len(notes), len(notes)))
+        symbols = np.zeros((len(notes), len(notes)), dtype=np.int8)
+        for i, row in enumerate(cells):
+            for j, cell in enumerate(row):
+                if isinstance(cell, str) and cell.strip() in markovSymbols:
+                    symbols[i, j] = markovSymbols.index(cell.strip()) + 1
+                elif IsNumber(cell) and np.isfinite(float(cell)):
+                    numbers[i, j] = float(cell)
                 else:
-                    time += currentNoteLength - 1/2
-            else:
-                Chord(int(currentChord),currentInterval,currentNoteLength)
-            pmCURRENT = 1
-            chCURRENT = 2
-            mlCURRENT = 1
-            
-        # melody
-        elif np.random.random() < ml * mlCURRENT:
-            if np.random.random() < pN:                   # might not change to chord not
-                currentNote = currentChord
-                
-            if np.random.random() < pN:                   # might change the length of the notes
-                currentNoteLength *= 2
-            elif np.random.random() < pN * 2:
-                currentNoteLength /= 2
-            
-            if currentNoteLength > 2:                     # make sure note lengths are not stupid
-                currentNoteLength = 1
-            elif currentNoteLength < 1/2:
-                currentNoteLength = 1
-                
-            # check how long is left, and correct to avoid overruns
-            if currentNoteLength > riffLength - time:
-                currentNoteLength = riffLength - time
-            
-            # lookup notes from markov chain
-            currentNote = np.random.choice(mtf.iloc[mtf.index.get_loc(currentNote)].index, p = mtf.iloc[mtf.index.get_loc(currentNote)])
-            Note(int(currentNote),currentNoteLength)
-            pmCURRENT = 1
-            chCURRENT = 1
-            mlCURRENT = 4    # more likely to keep playing notes
-            
-        # rest
-        elif np.random.random() < rs:
-            if np.random.random() < 0.5:
-                Rest(1/2)
-            else:
-                Rest(1)
-            pmCURRENT = 1
-            chCURRENT = 1
-            mlCURRENT = 1
-
-######################## OUTPUT ########################
-
-def WriteMIDIFile():
-    # function that names and saves midi files
-    # attributes to identify file uniquely
-    filename = ""
-    bars = riffLength / 4     # check how long the riff is
+                    raise ValueError("%s in %s has %r for %s to %s, weights must be numbers or one of %s"
+                                     % (chain, name, cell, notes[j], notes[i], markovSymbols))
+        if (numbers < 0).any():
+            raise ValueError("%s in %s has negative weights" % (chain, name))
+        weights = MarkovWeights(numbers, symbols).T         # each column is the weights from one note, now each row
+        for highestNote in highestNotes:        # cut down the same way the engine does, with howMuchCrazy = 0
+            keep = np.count_nonzero(notes <= highestNote)
+            CheckRows(notes[:keep], weights[:keep, :keep], "%s in %s" % (chain, name), highestNote)
+            if chain == 'tf' and Reachable(weights[:keep, :keep]) < mostChords:
+                raise ValueError("%s in %s can only get to %d notes from 0 with highestNote %d, there needs to be %d "
+                                 "(the most chords RandomiseInputs() picks)"
+                                 % (chain, name, Reachable(weights[:keep, :keep]), highestNote, mostChords))
+        compiled[chain + 'Numbers'] = numbers
+        compiled[chain + 'Symbols'] = symbols
+    return compiled
+
+def LoadMarkov(source, cache=True):
+    # the compiled chains and scales from a source, from the cache file if it's up to date
+    stamp = np.array([(os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in MarkovFiles(source)])
+    cachePath = os.path.join(source, 'markov.npz') if os.path.isdir(source) else source + '.npz'
+    if cache and os.path.exists(cachePath):
+        with np.load(cachePath) as cached:
+            if cached['version'] == markovCacheVersion and np.array_equal(cached['stamp'], stamp):
+                return {name: cached[name] for name in cached.files if name not in ['version', 'stamp']}
+    compiled = CompileMarkov(ReadMarkov(source), source)
+    if cache:
+        try:
+            temp = '%s.%d.tmp' % (cachePath, os.getpid())         # other processes might be loading it at the same time
+            with open(temp, 'wb') as f:
+                np.savez(f, version=markovCacheVersion, stamp=stamp, **compiled)
+            os.replace(temp, cachePath)
+        except OSError:
+            pass        # can't write next to the source, it'll just be read every time
+    return compiled
+
+def UseMarkov(source=None, cache=True):
+    # use the transfer functions and scales from source (see above) for every riff from now on, None to go back
+    # to the pasted in ones (harmonies added with AddHarmony() other than 3 and 7 need adding again)
+    global keyScale, keyHarmony3, keyHarmony7, markovChains, markovSource
+    if source is None:
+        markovChains = None
+        keyScale, keyHarmony3, keyHarmony7 = pastedScales
+    else:
+        markovChains = LoadMarkov(source, cache)
+        keyScale, keyHarmony3, keyHarmony7 = (markovChains[scale].tolist() for scale in ['keyScale', 'keyHarmony3', 'keyHarmony7'])
+    markovSource = source
+    AddHarmony(3, keyHarmony3)
+    AddHarmony(7, keyHarmony7)
+    ClearCache()
+
+def MarkovTable(chain):
+    # the notes and weights of a transfer function from UseMarkov(), the same way round as the pasted in ones
+    return markovChains['keyScale'], MarkovWeights(markovChains[chain + 'Numbers'], markovChains[chain + 'Symbols']).T
+
+######################## PALM MUTE PATTERNS ########################
+# the picking patterns are just data, each row is the notes of one pattern on the same palm muted note:
+# when each note is picked (in beats from the start of the pattern), how hard (velocity),
+# and whether the note is the harmony instead (for PM chords), then how long the pattern is (in beats),
+# and how likely it is compared to the other patterns of the same length
+# PalmMute() picks one of the 1 beat patterns, PalmMuteSHORT() one of the 1/2 beat patterns
+# to add a new pattern (triplet gallops, 16th bursts...) add a row and run CompilePalmMutePatterns(), e.g.
+# 'TripletGallop': ([0, 1/3, 2/3], [downPick, upPick, upPick], [0, 0, 0], 1, 1/4),
+# the weights are the odds the original chain of ifs had (1/4 gallop, 1/4 of what's left is a reverse gallop...)
+
+pmPatterns = {
+    #                  onsets               velocities                              harmony       length  weight
+    'Gallop':        ([0, 2/4, 3/4],       [downPick, downPick, upPick],           [0, 0, 0],    1,      1/4),
+    'RevGallop':     ([0, 1/4, 2/4],       [downPick, upPick, downPick],           [0, 0, 0],    1,      3/4 * 1/4),
+    'UpDown':        ([0, 1/4, 2/4, 3/4],  [downPick, upPick, downPick, upPick],   [0, 0, 0, 0], 1,      3/4 * 3/4 * 1/4),
+    'DownPM':        ([0, 2/4],            [downPick, downPick],                   [0, 0],       1,      3/4 * 3/4 * 3/4),
+    'UpDownSHORT':   ([0, 1/4],            [downPick, upPick],                     [0, 0],       1/2,    1/2),
+    'PMChordSHORT':  ([0, 0],              [downPick, downPick],                   [0, 1],       1/2,    1/2)}
+
+# the table is padded out to the longest pattern, so a whole riff of palm muting is expanded in one go (see PalmMuteEvents())
+# pmChoices has a sampling table for each pattern length: (pattern ids, cumulative weights)
+
+def CompilePalmMutePatterns():
+    global pmNames, pmOnsets, pmVelocities, pmHarmony, pmCounts, pmLengths, pmChoices
+    pmNames = list(pmPatterns)
+    width = max(len(pattern[0]) for pattern in pmPatterns.values())
+    pmOnsets = np.zeros((len(pmNames), width))
+    pmVelocities = np.zeros((len(pmNames), width), dtype=int)
+    pmHarmony = np.zeros((len(pmNames), width), dtype=bool)
+    pmCounts = np.zeros(len(pmNames), dtype=int)
+    pmLengths = np.zeros(len(pmNames))
+    for i, (onsets, velocities, harmony, length, weight) in enumerate(pmPatterns.values()):
+        pmOnsets[i, :len(onsets)] = onsets
+        pmVelocities[i, :len(onsets)] = velocities
+        pmHarmony[i, :len(onsets)] = harmony
+        pmCounts[i] = len(onsets)
+        pmLengths[i] = length
+    pmChoices = {}
+    for length in sorted(set(pmLengths.tolist())):
+        ids = np.flatnonzero(pmLengths == length)
+        weights = np.array([pmPatterns[pmNames[i]][4] for i in ids], dtype=float)
+        pmChoices[float(length)] = (ids, weights.cumsum() / weights.sum())
+
+CompilePalmMutePatterns()
+
+# every riff is kept as an array of note events until it's written out (see RiffSession.Events())
+eventType = np.dtype([('track', np.uint16), ('pitch', np.uint8), ('onset', float), ('duration', float),
+                      ('velocity', np.uint8), ('pm', bool)])
+
+def PalmMuteEvents(patterns, onsets, notes, intervals):
+    # expands palm mute patterns (row in the table, when, the note and interval) into their notes, pattern by pattern
+    harmonies = Harmonies(notes, intervals)
+    played = np.arange(pmOnsets.shape[1]) < pmCounts[patterns, None]      # drop the padding
+    pm = np.zeros(np.count_nonzero(played), dtype=eventType)
+    pm['track'] = PMtrack
+    pm['pitch'] = key + np.where(pmHarmony[patterns], harmonies[:, None], notes[:, None])[played]
+    pm['onset'] = (onsets[:, None] + pmOnsets[patterns])[played]
+    pm['duration'] = djent
+    pm['velocity'] = pmVelocities[patterns][played]
+    pm['pm'] = True
+    return pm
+
+######################## MIDI OUTPUT ########################
+# riffs are rendered to bytes in memory, the files are only written at the end (see WriteRiffs() below)
+
+def EventsToMIDIFile(events, trackNames=None):
+    # trackNames are only used when lots of riffs share one file (see CombinedMIDIFile())
+    tracks = int(events['track'].max()) + 1 if len(events) else 1
+    mf = MIDIFile(max(tracks, 1 + PMtrack))      # only 1 track unless PMtrack is used
+    mf.addTempo(track, 0, tempo)
+    mf.addTempo(PMtrack, 0, tempo)   # not needed for format 1 midi (default)
+    # mf.addTrackName(track, 0, "Sample Track") # use if you need to name the track
+    for i, name in enumerate(trackNames or []):
+        mf.addTrackName(i, 0, name)
+    for trk, pitch, onset, duration, volume, pm in events.tolist():
+        mf.addNote(trk, channel, pitch, onset, duration, volume, annotation="PM" if pm else None)
+    return mf
+
+def MIDIBytes(mf):
+    out = io.BytesIO()
+    mf.writeFile(out)
+    return out.getvalue()
+
+def RenderMIDI(events, trackNames=None, backend=None):
+    # the MIDI file for some events as bytes, using midiBackend unless another backend is given
+    if (backend or midiBackend) == 'fast':
+        midi = EncodeMIDI(events, trackNames)
+        if midi is not None:
+            return midi
+    elif (backend or midiBackend) != 'midiutil':
+        raise ValueError("backend must be 'midiutil' or 'fast', not %r" % backend)
+    return MIDIBytes(EventsToMIDIFile(events, trackNames))
+
+######################## FAST MIDI ENCODER ########################
+# midiutil makes two python objects for every note, sorts them, removes duplicates, untangles overlapping notes,
+# and packs each one with struct, which is most of the time it takes to write a riff
+# riffs are only note on/off events and one tempo, so EncodeMIDI() writes the same bytes directly from the event arrays:
+# the same file header, the same event order (tick, then note offs before note ons, then the order they were added),
+# and the delta times as variable length quantities, all vectorised
+# duplicate or overlapping notes on the same pitch are the only thing it doesn't copy from midiutil,
+# riffs never have them, but if some events do EncodeMIDI() returns None and RenderMIDI() falls back to midiutil
+
+ticksPerBeat = 960          # midiutil's default ticks per quarter note
+
+def VarLengths(values):
+    # MIDI variable length quantities for an array of ints (up to 4 bytes each, like midiutil)
+    # returns a row of 4 bytes per value, and how many of those bytes (from the right) are used
+    lengths = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    rows = ((values[:, None] >> np.array([21, 14, 7, 0])) & 0x7f) | np.array([0x80, 0x80, 0x80, 0])    # high bit on all but the last
+    return rows, lengths
+
+def TrackChunk(body):
+    return b"MTrk" + len(body).to_bytes(4, 'big') + body
+
+def VarLength(value):
+    # the same for one int, as bytes
+    encoded = [value & 0x7f]
+    while value >= 1 << 7:
+        value >>= 7
+        encoded.append(value & 0x7f | 0x80)
+    return bytes(reversed(encoded))
+
+def EncodeMessages(events):
+    # the note on and off messages of some events, encoded and in the same order as midiutil would write them
+    # returns the bytes, where each message starts in them (plus the end), and each message's track, tick,
+    # and how many bytes its delta time takes, or None if midiutil would have to untangle the notes
+    on = (events['onset'] * ticksPerBeat).astype(np.int64)          # same truncation as midiutil
+    off = on + (events['duration'] * ticksPerBeat).astype(np.int64)
+    trk = events['track'].astype(np.int64)
+    pitch = events['pitch'].astype(np.int64)
+
+    # anything midiutil would have to de-duplicate or de-interleave goes the slow way
+    if len(events):
+        order = np.lexsort((on, pitch, trk))
+        samePitch = (trk[order][1:] == trk[order][:-1]) & (pitch[order][1:] == pitch[order][:-1])
+        if np.any(off <= on) or np.any(samePitch & (on[order][1:] < off[order][:-1])):
+            return None
+
+    # every note is a note on and a note off, sorted the same way midiutil sorts them
+    n = len(events)
+    msgTrack = np.concatenate([trk, trk])
+    msgTick = np.concatenate([on, off])
+    msgKind = np.repeat([3, 2], n)                  # midiutil's sec_sort_order, note offs go first
+    msgOrder = np.tile(np.arange(n), 2)             # order the notes were added
+    order = np.lexsort((msgOrder, msgKind, msgTick, msgTrack))
+    msgTrack, msgTick, msgKind = msgTrack[order], msgTick[order], msgKind[order]
+    status = np.where(msgKind == 3, 0x90, 0x80) | channel
+    msgPitch = np.concatenate([pitch, pitch])[order]
+    msgVelocity = np.concatenate([events['velocity'], events['velocity']])[order]
+
+    # delta times from the previous event on the same track (the first one on each track is from 0)
+    deltas = msgTick.copy()
+    deltas[1:] -= msgTick[:-1]
+    firsts = np.flatnonzero(msgTrack[1:] != msgTrack[:-1]) + 1
+    deltas[firsts] = msgTick[firsts]
+
+    # each message is a row of its delta time then 3 bytes, the unused leading delta time bytes are dropped
+    messages = np.empty((2 * n, 7), dtype=np.uint8)
+    messages[:, :4], lengths = VarLengths(deltas)
+    messages[:, 4] = status
+    messages[:, 5] = msgPitch
+    messages[:, 6] = msgVelocity
+    data = messages[np.arange(7) >= 4 - lengths[:, None]].tobytes()
+    offsets = np.concatenate([[0], np.cumsum(lengths + 3)])       # where each message starts in data
+    return data, offsets, msgTrack, msgTick, lengths
+
+def MIDIHeader(tracks):
+    # the file header and midiutil's tempo track (format 1, so the tempo gets a track to itself)
+    tempoTrack = b"\x00\xff\x51\x03" + int(60000000 / tempo).to_bytes(3, 'big') + b"\x00\xff\x2f\x00"
+    return (b"MThd" + (6).to_bytes(4, 'big') + (1).to_bytes(2, 'big') + (tracks + 1).to_bytes(2, 'big')
+            + ticksPerBeat.to_bytes(2, 'big') + TrackChunk(tempoTrack))
+
+def TrackName(trackNames, t):
+    if trackNames and t < len(trackNames):
+        name = trackNames[t].encode("ISO-8859-1")
+        return b"\x00\xff\x03" + VarLength(len(name)) + name
+    return b""
+
+def EncodeMIDI(events, trackNames=None):
+    tracks = max(int(events['track'].max()) + 1 if len(events) else 1, 1 + PMtrack)
+    encoded = EncodeMessages(events)
+    if encoded is None:
+        return None
+    data, offsets, msgTrack, msgTick, lengths = encoded
+    chunks = [MIDIHeader(tracks)]
+    bounds = offsets[np.searchsorted(msgTrack, np.arange(tracks + 1))]
+    for t in range(tracks):
+        chunks.append(TrackChunk(TrackName(trackNames, t) + data[bounds[t]:bounds[t + 1]] + b"\x00\xff\x2f\x00"))
+    return b"".join(chunks)
+
+def RiffFilename(bars, chords, number, midi):
+    # bars and chords identify the riff, then a counter and a hash of the file so names never collide
+    # (this used to be a millisecond timestamp, which overwrote files when riffs were written faster than that)
+    # more attributes could be added (howMuchCrazy, highestNote, howMuchPM, tempo...) but they're all in Riff.inputs
     chordz = ""
-    for i in chordsInKey:
+    for i in chords:
         chordz += i
         chordz += "_"
-    now = datetime.now()
-    ############## IF YOU'RE NOT GETTING ALL OF YOUR FILES, ROUND THIS LESS VVVVV ##############
-    timestamp = now.strftime("%Y%m%d_%H%M%S.") + str(int(int(now.strftime("%f"))/1000))
-    filename = ("b" + str(int(bars)) 
-                # + "cz" + str(howMuchCrazy) 
-                # + "h" + str(highestNote) 
-                # + "pm" + str(howMuchPM) 
-                # + "ch" + str(howMuchCHORDS) 
-                # + "m" + str(howMuchMELODY) 
-                # + "r" + str(howMuchREST) 
-                # + "t" + str(tempo) 
-                + "_" + chordz
-                + timestamp
-                + ".mid")
-
-    with open(filename, 'wb') as out:
-        mf.writeFile(out)
+    return ("b" + str(int(bars))
+            + "_" + chordz
+            + "%06d_" % number
+            + hashlib.blake2b(midi, digest_size=4).hexdigest()
+            + ".mid")
+
+######################## ARRANGEMENT ########################
+# the songParts of a repeat share chords and style, so they go together as sections of one song, e.g. AAAB or ABAC
+# ArrangeMIDI() writes one MIDI file of the parts in the order of a form (A is the first part, B the second...),
+# each section starts where the last one ended (a part is riffLength long, even if it ends on a rest)
+# parts aren't written again for every section: each part's notes are encoded once (EncodeMessages()), and a section
+# is just those bytes with the first delta time on each track changed, so AAAB only encodes A and B once each
+# the bytes are the same as midiutil writes for the whole song (ArrangementEvents()), which is what's used instead
+# if a part has notes the fast encoder can't do, notes past the end of the part, or notes that would land on a
+# different tick (e.g. triplets, midiutil rounds the song's ticks down, and start + a rounded down onset isn't
+# always the same)
+
+def FormSections(form, parts):
+    sections = [ord(letter) - ord('A') for letter in form.upper()]
+    if not sections or min(sections) < 0 or max(sections) >= parts:
+        raise ValueError("form must be letters A to %s (one for each part), not %r" % (chr(ord('A') + parts - 1), form))
+    return sections
+
+def ArrangementEvents(parts, lengths, form):
+    # the events of the whole song, each part's events moved to where its sections start
+    sections = FormSections(form, len(parts))
+    starts = np.concatenate([[0], np.cumsum([lengths[i] for i in sections])[:-1]])
+    events = np.concatenate([parts[i] for i in sections])
+    events['onset'] += np.repeat(starts, [len(parts[i]) for i in sections])
+    return events
+
+def ArrangeMIDI(parts, lengths, form, trackNames=None, backend=None):
+    # parts are event arrays (see RiffSession.Events()), lengths are how long each part is (in beats)
+    # backend is only used if the parts can't be joined as they are (see above)
+    sections = FormSections(form, len(parts))
+    tracks = max([int(parts[i]['track'].max()) + 1 for i in sections if len(parts[i])] + [1 + PMtrack])
+    beats = np.concatenate([[0], np.cumsum([lengths[i] for i in sections])[:-1]])
+    starts = beats * ticksPerBeat
+    encoded = {}
+    for i in set(sections):
+        fits = not len(parts[i]) or (parts[i]['onset'] + parts[i]['duration']).max() <= lengths[i]
+        encoded[i] = EncodeMessages(parts[i]) if fits else None
+    # every note has to land on the same tick moved to where its section starts as it does in the part by itself
+    same = np.all(starts == np.floor(starts)) and all(
+        np.array_equal(((parts[i]['onset'] + start) * ticksPerBeat).astype(np.int64),
+                       int(start * ticksPerBeat) + (parts[i]['onset'] * ticksPerBeat).astype(np.int64))
+        for i, start in zip(sections, beats.tolist()))
+    if any(part is None for part in encoded.values()) or not same:
+        return RenderMIDI(ArrangementEvents(parts, lengths, form), trackNames, backend)
+
+    # each part on each track: (first tick, last tick, the messages without the first delta time)
+    pieces = {}
+    for i, (data, offsets, msgTrack, msgTick, deltaLengths) in encoded.items():
+        bounds = np.searchsorted(msgTrack, np.arange(tracks + 1))
+        for t in range(tracks):
+            first, end = bounds[t], bounds[t + 1]
+            if first < end:
+                pieces[i, t] = (int(msgTick[first]), int(msgTick[end - 1]),
+                                data[offsets[first] + deltaLengths[first]:offsets[end]])
+
+    chunks = [MIDIHeader(tracks)]
+    for t in range(tracks):
+        body = [TrackName(trackNames, t)]
+        last = 0        # tick of the last message on this track
+        for i, start in zip(sections, starts.astype(int).tolist()):
+            if (i, t) in pieces:
+                first, end, messages = pieces[i, t]
+                body += [VarLength(start + first - last), messages]
+                last = start + end
+        chunks.append(TrackChunk(b"".join(body) + b"\x00\xff\x2f\x00"))
+    return b"".join(chunks)
+
+def Arrange(riffs, form='AAAB', trackNames=None, backend=None):
+    # the same for Riffs (e.g. the songParts of one repeat from generate_batch())
+    return ArrangeMIDI([riff.events for riff in riffs], [riff.length for riff in riffs], form, trackNames, backend)
+
+######################## LOOP COUNTERS ########################
+# some riffs take a lot longer to write than others, mostly because of passes of the RiffGenerator() loop that don't
+# do anything (every section's odds missed, e.g. when howMuchREST is 0), so the loop can be counted:
+# RiffSession(counters=LoopCounters()) counts the passes of the loop, the ones that did nothing, how many times each
+# section was picked, the Markov chain draws (a chord every pass, and a note for melody) and the notes written,
+# for every riff, and keeps totals and histograms (per riff) of them, and of how long each riff took
+# counters=None (the default) costs one check a pass, so it can always be left in
+# Stats() has everything as a dict (for JSON), Prometheus() as Prometheus text, Write() saves either one
+# counters from different sessions (or processes) can be added up with Merge()
+
+loopSections = ['pm', 'chords', 'melody', 'rest', 'none']      # 'none' is a pass that did nothing
+
+# the histogram buckets (upper bounds, per riff)
+loopBuckets = {'iterations': [4, 8, 16, 32, 64, 128, 256],
+               'wasted': [0, 1, 2, 4, 8, 16, 32, 64],
+               'draws': [4, 8, 16, 32, 64, 128, 256],
+               'notes': [4, 8, 16, 32, 64, 128],
+               'seconds': [1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2]}
+
+class LoopCounters:
+
+    def __init__(self):
+        self.riffs = 0
+        self.hits = [0] * len(loopSections)             # this riff's, RiffGenerator() counts straight into it
+        self.sections = dict.fromkeys(loopSections, 0)
+        self.totals = dict.fromkeys(loopBuckets, 0)
+        self.histograms = {name: [0] * (len(buckets) + 1) for name, buckets in loopBuckets.items()}    # last is +Inf
+
+    def Start(self):
+        self.hits = [0] * len(loopSections)
+        return perf_counter()
+
+    def Finish(self, session, start):
+        # adds up the riff the session just wrote
+        seconds = perf_counter() - start
+        iterations = sum(self.hits)
+        riff = {'iterations': iterations, 'wasted': self.hits[-1], 'draws': iterations + self.hits[2],
+                'notes': len(session.notes) + int(pmCounts[np.array(session.pmPattern, dtype=int)].sum()),
+                'seconds': seconds}
+        self.riffs += 1
+        for section, hits in zip(loopSections, self.hits):
+            self.sections[section] += hits
+        for name, value in riff.items():
+            self.totals[name] += value
+            self.histograms[name][bisect.bisect_left(loopBuckets[name], value)] += 1
+
+    def Merge(self, other):
+        self.riffs += other.riffs
+        for section in loopSections:
+            self.sections[section] += other.sections[section]
+        for name in loopBuckets:
+            self.totals[name] += other.totals[name]
+            self.histograms[name] = [a + b for a, b in zip(self.histograms[name], other.histograms[name])]
+        return self
+
+    def Stats(self):
+        return {'riffs': self.riffs, 'totals': dict(self.totals), 'sections': dict(self.sections),
+                'histograms': {name: {'buckets': loopBuckets[name] + ['+Inf'], 'counts': list(counts)}
+                               for name, counts in self.histograms.items()}}
+
+    def Prometheus(self, prefix='riff_'):
+        lines = ['# TYPE %sriffs_total counter' % prefix, '%sriffs_total %d' % (prefix, self.riffs),
+                 '# TYPE %ssection_hits_total counter' % prefix]
+        lines += ['%ssection_hits_total{section="%s"} %d' % (prefix, section, hits) for section, hits in self.sections.items()]
+        for name, counts in self.histograms.items():
+            metric = prefix + name
+            lines.append('# TYPE %s histogram' % metric)
+            cumulative = np.cumsum(counts)
+            lines += ['%s_bucket{le="%s"} %d' % (metric, bound, count) for bound, count in zip(loopBuckets[name] + ['+Inf'], cumulative)]
+            lines += ['%s_sum %s' % (metric, self.totals[name]), '%s_count %d' % (metric, self.riffs)]
+        return "\n".join(lines) + "\n"
+
+    def Write(self, path, format='json'):
+        # saves Stats() as JSON, or format='prometheus' for Prometheus text (e.g. for node_exporter's textfile collector)
+        if format == 'json':
+            import json
+            text = json.dumps(self.Stats(), indent=2)
+        elif format == 'prometheus':
+            text = self.Prometheus()
+        else:
+            raise ValueError("format must be 'json' or 'prometheus', not %r" % format)
+        with open(path, 'w') as out:
+            out.write(text)
+
+######################## RIFF SESSION ########################
+# everything needed to write riffs lives on a RiffSession: the clock, the MIDI file, the randomised inputs,
+# the transfer functions, and its own random number generator
+# nothing is shared between sessions, so riffs can be written on multiple threads at once (one session each)
+# seed is anything np.random.default_rng() accepts (an int, a SeedSequence...), None for a random seed
+
+randomisedInputs = ['howMuchCrazy', 'howManyChords', 'highestNote', 'howMuchPM', 'howMuchCHORDS', 'howMuchMELODY', 'howMuchREST']
+highestNotes = [12,13,14,15,17,18,19,20,22,23,24]      # the highestNotes RandomiseInputs() picks from
+mostChords = 7                                          # and the most chords it picks
+
+# internal probabilites of variation within sections of the while loop in RiffGenerator() (and LockstepRiffs())
+# to modify these, you'll need to spend time looking at the loop in detail
+# there is probably a better way to parameterise these, but this worked well enough
+pPM = 0.5   # PM internal probability
+pCH = 0.2   # Chords internal probability
+pN = 0.3    # Melody / note internal probability
+
+class RiffSession:
+
+    def __init__(self, seed=None, backend=None, counters=None):
+        self.rng = np.random.default_rng(seed)
+        self.backend = backend       # None for midiBackend
+        self.counters = counters     # a LoopCounters to count RiffGenerator()'s loop, None to not count
+        self.time = 0
+        self.mf = None
+        self.riffCount = 0           # numbers the files from WriteMIDIFile()
+
+    def CreateMIDIFile(self):
+        # starts a new riff, the notes are kept in the event buffers until the MIDIFile is built
+        self.time = 0                # start at the beginning
+        self.mf = None
+        self.notes = []              # (track, pitch, onset, duration, velocity, pm) of chords and notes
+        self.pmPattern = []          # palm muting, one entry per pattern: which one, when, the note and interval
+        self.pmOnset = []
+        self.pmNote = []
+        self.pmInterval = []
+
+    def BuildMIDIFile(self, events=None):
+        self.mf = EventsToMIDIFile(self.Events() if events is None else events)
+
+    ######################## INPUTS TO RANDOMISE ########################
+    # inputs that are used in the riff generation function, ranges are typically
+    # change the high and low range to change the output style
+    # typically ratings out of 10 (to be normalised later), but are not actually restricted to 10
+    # try extreme values at your own risk (also, negative values probably break stuff)
+
+    # any inputs passed in are used instead of the random ones, e.g. RandomiseInputs(howManyChords=3)
+    # (the random numbers are still drawn, so fixing one input doesn't change the others)
+
+    def RandomiseInputs(self, **fixed):
+        rng = self.rng
+        self.howMuchCrazy = int(rng.integers(0,2))           # how likly the pattern is to not follow the flowchart
+        self.howManyChords = int(rng.integers(2,mostChords + 1))     # how many chords in chord progression transfer matrix
+        self.highestNote = int(rng.choice(highestNotes))      # highest note available (note must be in keyScale above)
+        self.howMuchPM = int(rng.integers(3,9))              # int out of 10, a priority (not actually restricted to 10)
+        self.howMuchCHORDS = int(rng.integers(3,9))          # int out of 10, a priority
+        self.howMuchMELODY = int(rng.integers(3,9))          # int out of 10, a priority
+        self.howMuchREST = int(rng.integers(0,4))            # int out of 10, a priority
+        for name, value in fixed.items():
+            if name not in randomisedInputs:
+                raise ValueError("%r is not one of the randomised inputs %s" % (name, randomisedInputs))
+            setattr(self, name, value.item() if isinstance(value, np.generic) else value)    # numpy ints to ints
+
+    def RandomisedInputs(self):
+        inputs = {name: getattr(self, name) for name in randomisedInputs}
+        inputs['tempo'] = tempo
+        return inputs
+
+    ######################## TRANSFER FUNCTIONS ########################
+
+    def TransferFunction(self):
+        self.tfNotes, self.tfCDF, self.tfIndex, self.tf = CompiledTransferFunction(self.highestNote, self.howMuchCrazy)
+
+    def MelodyTransferFunction(self):
+        self.mtfNotes, self.mtfCDF, self.mtfIndex, self.mtf = CompiledMelodyTransferFunction(self.highestNote, self.howMuchCrazy)
+
+    ######################## CHORDS ########################
+    # this function limits the number of chords in the scale
+    # it starts on the root note (the root chord is always included)
+    # and follows the transfer function through n = howManyChords
+
+    def ChordsTransferFunction(self):
+        self.chordsInKey = chordsInKey = []
+        chordsInKey.append(str(self.tfNotes[0]))  # always include tonic in chords
+        newChord = 0   # initialise newChord (row in the compiled tf, row 0 is the root)
+        reachable = ReachableChords(self.highestNote, self.howMuchCrazy)
+        if reachable < self.howManyChords:
+            raise ValueError("only %d chords can be reached from the root with highestNote %d, not howManyChords %d"
+                             % (reachable, self.highestNote, self.howManyChords))
+
+        while len(chordsInKey) < self.howManyChords:
+            newChord = self.Draw(self.tfCDF, newChord)
+            if str(self.tfNotes[newChord]) not in chordsInKey:
+                chordsInKey.append(str(self.tfNotes[newChord]))
+
+        self.ctNotes, self.ctCDF, self.ctIndex = CompiledChordsTransferFunction(
+            self.highestNote, self.howMuchCrazy, tuple(chordsInKey))
+
+    ######################## CHORD PROGRESSION TRANSFER FUNCTION ########################
+    # print(self.ctNotes, np.diff(self.ctCDF, prepend=0))   # order doesn't matter
+
+    def Draw(self, cdf, row):
+        # pick the next row/column from the current one (returns the index, not the note)
+        return int(cdf[row].searchsorted(self.rng.random(), side='right'))
+
+    ######################## FUNCTIONS ########################
+    # here are all of the musical building blocks used in the riff generation engine
+
+    def Chord(self,note,interval,length):   # length in beats
+        pitch = key + note
+        pitch2 = key + Harmony(note,interval)
+        volume = chordPick
+        self.notes.append((track, pitch, self.time, length, volume, False))
+        self.notes.append((track, pitch2, self.time, length, volume, False))
+        self.time += length
+
+    def Note(self,note,length):
+        pitch = key+note
+        volume = chordPick
+        self.notes.append((track, pitch, self.time, length, volume, False))
+        self.time += length
+
+    def Rest(self,length):
+        self.time += length
+
+    def PalmMutePattern(self,pattern,note,interval=7):
+        # pattern is the row in the pmPatterns table, the notes are expanded later in Events()
+        self.pmPattern.append(pattern)
+        self.pmOnset.append(self.time)
+        self.pmNote.append(note)
+        self.pmInterval.append(interval)
+        self.time += pmLengths[pattern]
+
+    def PickPattern(self,length):
+        ids, cdf = pmChoices[length]
+        return int(ids[cdf.searchsorted(self.rng.random(), side='right')])
+
+    ############ if you would prefer a specific PM pattern, change the weights in pmPatterns (0 to never play a pattern) ############
+    def PalmMute(self,note):
+        self.PalmMutePattern(self.PickPattern(1), note)
+
+    def PMChordSHORT(self,note,interval):
+        self.PalmMutePattern(pmNames.index('PMChordSHORT'), note, interval)
+
+    def PalmMuteSHORT(self,note,interval):
+        self.PalmMutePattern(self.PickPattern(1/2), note, interval)
+
+    def Events(self):
+        # all of the riff's notes as an eventType array, in the order they're played
+        notes = np.array(self.notes, dtype=eventType)
+        pm = PalmMuteEvents(np.array(self.pmPattern, dtype=int), np.array(self.pmOnset, dtype=float),
+                            np.array(self.pmNote, dtype=int), np.array(self.pmInterval, dtype=int))
+        events = np.concatenate([notes, pm])
+        return events[np.argsort(events['onset'], kind='stable')]
+
+    ######################## RIFF GENERATING ENGINE ########################
+
+    ############ if you want a specific length, you could modify this function or sett all the attributes equal above ############
+    def RiffLengthRandom(self):
+        if self.rng.random() < 1/3:
+            self.riffLength = riffLengthMin
+        elif self.rng.random() < 1/2:
+            self.riffLength = riffLengthMed
+        else:
+            self.riffLength = riffLengthMax
+
+    def SetupRepeat(self, inputs=None):
+        # everything before the riffs of a repeat: new inputs (inputs are any to fix), transfer functions, chords and
+        # riff length, the same for every engine (GenerateRepeat(), GenerateLockstep(), sweep()...)
+        # returns the session, e.g. RiffSession(seed).SetupRepeat()
+        self.CreateMIDIFile()
+        self.RandomiseInputs(**(inputs or {}))
+        self.TransferFunction()
+        self.MelodyTransferFunction()
+        self.ChordsTransferFunction()
+        self.RiffLengthRandom()
+        return self
+
+    def RiffGenerator(self):
+        # inputs and initialisation
+
+        currentChord = 0            # row in the compiled chord transfer function (row 0 is the root)
+        palmMuteNote = 0
+        currentNoteLength = 1/2
+        currentNote = 0             # a note, not a row (notes and chords have different transfer functions)
+
+        howMuch = self.howMuchPM + self.howMuchCHORDS + self.howMuchMELODY + self.howMuchREST
+        pm = self.howMuchPM / howMuch
+        ch = self.howMuchCHORDS / howMuch
+        ml = self.howMuchMELODY / howMuch
+        rs = self.howMuchREST / howMuch
+
+        # when doing something, more likely to keep doing that
+        # stickinessFactor = 2
+        pmCURRENT = 1
+        chCURRENT = 1
+        mlCURRENT = 1
+
+        # the internal probabilities of variation within sections of the while loop (pPM, pCH, pN) are settings,
+        # above RiffSession, so they can be swept (see sweep())
+
+    ######################## CALCULATION ########################
+    # complicated nested whiles and ifs that follow my musical intuition about how to make a metal guitar riff
+    # there is a stickiness factor at the end of each section, the odds are more likely that will happen again
+    # the stickiness was a variable, but now it's a magic number because different values seem to work better for different sections
+    # again, I could probably parameterise this better, but it is what it is
+
+        random = self.rng.random
+        riffLength = self.riffLength
+        counters = self.counters
+        if counters is not None:
+            start = counters.Start()
+            hits = counters.hits
+        while self.time < riffLength:
+            # markov chain to change chord
+            currentChord = self.Draw(self.ctCDF, currentChord)
+            chordNote = int(self.ctNotes[currentChord])
+            currentInterval = 7
+            self.time = int(self.time * 2) / 2                  # correct rounding errors in time, only 1/8 notes
+
+            # palm muting
+            if random() < pm * pmCURRENT:
+                if random() > pPM:
+                    palmMuteNote = chordNote
+                else:
+                    palmMuteNote = 0
+                if self.time % 1 != 0:                      # should only be 1/2 or 1 unless rounding errors
+                    self.PalmMuteSHORT(palmMuteNote,currentInterval)
+                else:
+                    self.PalmMute(palmMuteNote)
+                pmCURRENT = 2
+                chCURRENT = 1
+                mlCURRENT = 1
+                if counters is not None:
+                    hits[0] += 1
+
+            # chords
+            elif random() < ch * chCURRENT:
+                #chord length
+                if random() < pCH:
+                    currentNoteLength = 1/2
+                elif random() < pCH:
+                    currentNoteLength = 3/2
+                elif random() < pCH / 2:          # less chance of long chord
+                    currentNoteLength = 2
+                else:
+                    currentNoteLength = 1
+                # check how long is left, and correct to avoid overruns
+                if currentNoteLength > riffLength - self.time:
+                    currentNoteLength = riffLength - self.time
+
+                # change the chord interval randomly (mostly 5ths (7), but some 3rds)
+                if random() < pCH:
+                    currentInterval = 3
+                else:
+                    currentInterval = 7
+
+                if random() < pCH:             # PM chords
+                    self.PMChordSHORT(chordNote,currentInterval)
+                    if currentNoteLength >= 1:          # max of 2 PM chords in a row even with a longer chord, maybe fix this logic
+                        self.PMChordSHORT(chordNote,currentInterval)
+                        self.time += currentNoteLength - 1
+                    else:
+                        self.time += currentNoteLength - 1/2
+                else:
+                    self.Chord(chordNote,currentInterval,currentNoteLength)
+                pmCURRENT = 1
+                chCURRENT = 2
+                mlCURRENT = 1
+                if counters is not None:
+                    hits[1] += 1
+
+            # melody
+            elif random() < ml * mlCURRENT:
+                if random() < pN:                   # might not change to chord not
+                    currentNote = chordNote
+
+                if random() < pN:                   # might change the length of the notes
+                    currentNoteLength *= 2
+                elif random() < pN * 2:
+                    currentNoteLength /= 2
+
+                if currentNoteLength > 2:                     # make sure note lengths are not stupid
+                    currentNoteLength = 1
+                elif currentNoteLength < 1/2:
+                    currentNoteLength = 1
+
+                # check how long is left, and correct to avoid overruns
+                if currentNoteLength > riffLength - self.time:
+                    currentNoteLength = riffLength - self.time
+
+                # lookup notes from markov chain
+                currentNote = int(self.mtfNotes[self.Draw(self.mtfCDF, self.mtfIndex[currentNote])])
+                self.Note(currentNote,currentNoteLength)
+                pmCURRENT = 1
+                chCURRENT = 1
+                mlCURRENT = 4    # more likely to keep playing notes
+                if counters is not None:
+                    hits[2] += 1
+
+            # rest
+            elif random() < rs:
+                if random() < 0.5:
+                    self.Rest(1/2)
+                else:
+                    self.Rest(1)
+                pmCURRENT = 1
+                chCURRENT = 1
+                mlCURRENT = 1
+                if counters is not None:
+                    hits[3] += 1
+
+            # nothing (every section missed)
+            elif counters is not None:
+                hits[4] += 1
+
+        if counters is not None:
+            counters.Finish(self, start)
+
+    ######################## OUTPUT ########################
+
+    def WriteMIDIFile(self):
+        # function that names and saves midi files, returns the events that were saved (see Events())
+        events = self.Events()
+        midi = self.RenderMIDIFile(events)
+        filename = RiffFilename(self.riffLength / 4, self.chordsInKey, self.riffCount, midi)
+        self.riffCount += 1
+        with open(filename, 'wb') as out:
+            out.write(midi)
+        return events
+
+    def WriteArrangement(self, parts, form):
+        # saves the songParts (Events() of each one) as one MIDI file in the order of form, e.g. AAAB (see ArrangeMIDI())
+        midi = ArrangeMIDI(parts, [self.riffLength] * len(parts), form, backend=self.backend)
+        filename = form + "_" + RiffFilename(self.riffLength * len(form) / 4, self.chordsInKey, self.riffCount, midi)
+        self.riffCount += 1
+        with open(filename, 'wb') as out:
+            out.write(midi)
+
+    def RenderMIDIFile(self, events=None):
+        # same as WriteMIDIFile() but returns the bytes instead of saving a file
+        # (self.mf is only built by the midiutil backend)
+        if (self.backend or midiBackend) == 'midiutil':
+            self.BuildMIDIFile(events)
+            return MIDIBytes(self.mf)
+        return RenderMIDI(self.Events() if events is None else events, backend=self.backend)
 
 def Main():
     # this runs through the functions in order to produce a metal guitar riff and save a midi file in your working directory
@@ -480,20 +1199,884 @@ def Main():
 
     repeats = 5             # run the entire riff generator multiple times, each time iterating over all songParts
     songParts = 3           # 2 or 3 for AAAB ABAC etc song structure, using same chords (more coherent) / more for full song
+    form = None             # e.g. 'AAAB' or 'ABAC' to also save the songParts of each repeat as one song (see ArrangeMIDI())
+    session = RiffSession()
     for i in range(repeats):
-        CreateMIDIFile() 
-        RandomiseInputs()
-        TransferFunction()
-        MelodyTransferFunction()
-        ChordsTransferFunction()
-        RiffLengthRandom()
-        ############## IF YOU'RE NOT GETTING ALL OF YOUR FILES, ROUND TIMESTAMP LESS ##############
-        ############## see above in WriteMIDIFile() function definition ##############
+        session.CreateMIDIFile()
+        session.RandomiseInputs()
+        session.TransferFunction()
+        session.MelodyTransferFunction()
+        session.ChordsTransferFunction()
+        session.RiffLengthRandom()
+        parts = []
         for j in range(songParts):
             if j > 0:
-                CreateMIDIFile() 
-            RiffGenerator()
-            WriteMIDIFile()
+                session.CreateMIDIFile()
+            session.RiffGenerator()
+            events = session.WriteMIDIFile()
+            if form:
+                parts.append(events)
+        if form:
+            session.WriteArrangement(parts, form)
+
+######################## BATCH GENERATION ########################
+# generate_batch() does the same thing as Main(), but spreads the repeats over multiple processes
+# every repeat gets its own child of one np.random.SeedSequence, so the riffs for a seed are the same
+# no matter how many workers are used (or which worker a repeat ends up on)
+
+@dataclass
+class Riff:
+    midi: bytes         # the MIDI file
+    chords: list        # chordsInKey
+    bars: int
+    inputs: dict        # the randomised inputs used for this riff
+    repeat: int         # which repeat / songPart of the batch this riff is
+    part: int
+    events: np.ndarray  # the notes, see eventType
+    length: float       # riffLength, in beats
+    seed: object        # the repeat's np.random.SeedSequence, to write the riff again (see RiffCatalogue)
+    fixed: dict         # the inputs that were fixed for the batch (None if none were)
+    lockstep: tuple     # (first repeat, repeats, songParts) of the LockstepRiffs() that wrote it, None for RiffGenerator()
+    patterns: np.ndarray    # how many times each palm mute pattern was played (see pmNames)
+
+def GenerateRepeat(seed, repeat, songParts, backend=None, inputs=None):
+    # one repeat of Main(), in whatever process this ends up running in
+    # inputs are any randomised inputs to fix (see RandomiseInputs())
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)      # the same riffs, but the seed can be kept
+    session = RiffSession(seed, backend).SetupRepeat(inputs)
+    riffs = []
+    for j in range(songParts):
+        if j > 0:
+            session.CreateMIDIFile()
+        session.RiffGenerator()
+        events = session.Events()
+        riffs.append(Riff(session.RenderMIDIFile(events), list(session.chordsInKey), int(session.riffLength / 4),
+                          session.RandomisedInputs(), repeat, j, events, session.riffLength, seed, inputs, None,
+                          np.bincount(np.array(session.pmPattern, dtype=int), minlength=len(pmNames))))
+    return riffs
+
+def CombinedMIDIFile(riffs, names, backend=None):
+    # every riff on its own track(s) of one MIDI file, named after the file it would have been
+    offsets = np.cumsum([0] + [1 + PMtrack] * (len(riffs) - 1))
+    events = np.concatenate([riff.events for riff in riffs])
+    events['track'] += np.repeat(offsets, [len(riff.events) for riff in riffs]).astype(np.uint16)
+    trackNames = [name for name in names for t in range(1 + PMtrack)]
+    return RenderMIDI(events, trackNames, backend)
+
+def WriteRiffs(riffs, out, format='dir', backend=None):
+    # saves a batch of riffs in one go
+    # 'dir': a folder of MIDI files, 'zip' or 'tar': one archive of MIDI files, 'mid': one MIDI file with a track for each riff
+    # 'events': an EventStore folder (just the notes, added to the end if there's already one there)
+    # everything except 'dir' is built in memory and written to out with a single write
+    if format == 'events':
+        EventStore(out).Append(riffs)
+        return
+    names = [RiffFilename(riff.bars, riff.chords, i, riff.midi) for i, riff in enumerate(riffs)]
+    if format == 'dir':
+        os.makedirs(out, exist_ok=True)
+        for name, riff in zip(names, riffs):
+            with open(os.path.join(out, name), 'wb') as f:
+                f.write(riff.midi)
+        return
+    import tarfile
+    import zipfile
+    buffer = io.BytesIO()
+    if format == 'zip':
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:     # MIDI is tiny, compressing isn't worth it
+            for name, riff in zip(names, riffs):
+                archive.writestr(name, riff.midi)
+    elif format == 'tar':
+        with tarfile.open(fileobj=buffer, mode='w') as archive:
+            for name, riff in zip(names, riffs):
+                info = tarfile.TarInfo(name)
+                info.size = len(riff.midi)
+                archive.addfile(info, io.BytesIO(riff.midi))
+    elif format == 'mid':
+        buffer.write(CombinedMIDIFile(riffs, names, backend))
+    else:
+        raise ValueError("format must be 'dir', 'zip', 'tar', 'mid' or 'events', not %r" % format)
+    with open(out, 'wb') as f:
+        f.write(buffer.getvalue())
+
+# workers that aren't forked (spawn is the default on Windows and macOS, and forkserver on Linux from Python 3.14)
+# import this file again and get the settings as they are written in it, not as they were changed since, so every
+# pool is given a copy of the settings (WorkerSettings()) that each worker puts in place first (UseSettings())
+# otherwise a seed would give different riffs depending on the number of workers
+
+workerSettings = ['tempo', 'djent', 'key', 'downPick', 'upPick', 'chordPick', 'riffLengthMin', 'riffLengthMed',
+                  'riffLengthMax', 'channel', 'track', 'PMtrack', 'midiBackend', 'ticksPerBeat', 'stay', 'h', 'm', 'p',
+                  'pPM', 'pCH', 'pN', 'highestNotes', 'mostChords', 'pmPatterns', 'keyScale', 'keyHarmony3',
+                  'keyHarmony7', 'harmonyTable', 'markovChains', 'markovSource']
+
+def WorkerSettings():
+    return {name: globals()[name] for name in workerSettings}
+
+def UseSettings(settings):
+    # puts the settings from WorkerSettings() in place (in a worker), and rebuilds what's built from them
+    settings = dict(settings)
+    harmonies = dict(settings.pop('harmonyTable', harmonyTable))        # a copy, it can be this process's own table
+    globals().update(settings)
+    harmonyTable.clear()
+    harmonyTable.update(harmonies)
+    CompilePalmMutePatterns()
+    ClearCache()
+
+def WorkerPool(workers):
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(workers, initializer=UseSettings, initargs=(WorkerSettings(),))
+
+def GenerateRepeats(seeds, firstRepeat, workers, songParts, backend, inputs, engine):
+    # the riffs for a list of repeat seeds, spread over workers processes
+    n = len(seeds)
+    if engine == 'session':
+        jobs = [GenerateRepeat, seeds, range(firstRepeat, firstRepeat + n)]
+    elif engine == 'lockstep':
+        starts = range(0, n, lockstepRepeats)
+        jobs = [GenerateLockstep, [seeds[i:i + lockstepRepeats] for i in starts], [firstRepeat + i for i in starts]]
+    else:
+        raise ValueError("engine must be 'session' or 'lockstep', not %r" % engine)
+    jobs += [[songParts] * len(jobs[1]), [backend] * len(jobs[1]), [inputs] * len(jobs[1])]
+    if workers == 1:
+        repeats = map(*jobs)
+        return [riff for repeat in repeats for riff in repeat]
+    with WorkerPool(workers) as pool:
+        repeats = pool.map(*jobs, chunksize=max(1, len(jobs[1]) // (workers * 4)))
+        return [riff for repeat in repeats for riff in repeat]
+
+def generate_batch(n, workers=None, seed=None, songParts=3, out=None, format='dir', backend=None, inputs=None,
+                   engine='session', dedup=None, regenerate=False, catalogue=None):
+    # n repeats (n * songParts riffs), returns the list of Riffs, or saves them to out if given (see WriteRiffs())
+    # workers=None uses every core, workers=1 runs in this process, backend is the MIDI backend (see midiBackend)
+    # inputs are any randomised inputs to fix for every riff, e.g. {'howManyChords': 3}
+    # engine='lockstep' writes the riffs with LockstepRiffs() instead of RiffGenerator(), a lot faster for big batches
+    # dedup is a RiffIndex (or the file for one) to leave out riffs that are the same or nearly the same as one
+    # that's already been written (see DEDUPLICATION below), regenerate=True writes more repeats to make up the numbers
+    # catalogue is a RiffCatalogue (or the file for one) to record the riffs in (see RIFF CATALOGUE below)
+    seeds = np.random.SeedSequence(seed)
+    workers = workers or os.cpu_count()
+    riffs = GenerateRepeats(seeds.spawn(n), 0, workers, songParts, backend, inputs, engine)
+    if dedup is not None:
+        index = dedup if isinstance(dedup, RiffIndex) else RiffIndex(dedup)
+        riffs = index.Filter(riffs)
+        repeats = n
+        while regenerate and len(riffs) < n * songParts and repeats < n * dedupRetries:
+            more = min(-(-(n * songParts - len(riffs)) // songParts), n * dedupRetries - repeats)
+            riffs += index.Filter(GenerateRepeats(seeds.spawn(more), repeats, workers, songParts, backend, inputs, engine),
+                                  n * songParts - len(riffs))        # so only the riffs that are returned are indexed
+            repeats += more
+        if index is not dedup:
+            index.Close()
+    if catalogue is not None:
+        records = catalogue if isinstance(catalogue, RiffCatalogue) else RiffCatalogue(catalogue)
+        records.Add(riffs)
+        if records is not catalogue:
+            records.Close()
+    if out is None:
+        return riffs
+    WriteRiffs(riffs, out, format, backend)
+
+######################## DEDUPLICATION ########################
+# with few chords, low notes and no crazy, lots of riffs come out the same (or nearly), RiffIndex keeps track of every
+# riff that's been written in an SQLite file, so the same riff isn't written twice, even across batches
+# same: a fingerprint (hash) of the riff's notes (track, onset, pitch and duration, in ticks, in a fixed order)
+# nearly the same: a MinHash sketch of the riff, minHashes hashes of every run of ngram notes on each track (the pitch,
+# length and time since the last note, so moving a riff in time doesn't change it), the fraction of the hashes two
+# riffs have in common is about the fraction of note runs they have in common (the Jaccard similarity)
+# riffs at least dedupThreshold similar count as the same
+# comparing with every riff in the index would be too slow for millions of riffs, so the sketch is cut into lshBands bands
+# and only riffs with a whole band the same are compared (locality sensitive hashing), which finds almost every riff
+# over about (1 / lshBands) ** (lshBands / minHashes) similar (0.5 for 16 bands of 4), then those are compared properly
+# everything is in the file, not in memory, and looked up with its indexes, so it stays fast with millions of riffs
+# the sketches are kept as 16 bits of each hash (128 bytes a riff), plenty to compare them
+
+minHashes = 64
+lshBands = 16
+ngram = 3
+dedupThreshold = 0.8
+dedupRetries = 10           # regenerate gives up after writing this many times the repeats asked for
+minHashSeeds = np.random.SeedSequence(0).generate_state(minHashes, np.uint64)
+
+def Mix(x):
+    # splitmix64's finaliser, a quick hash of every uint64 in an array
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def RiffSketches(riffEvents):
+    # the fingerprint (signed 64 bit int, for SQLite), MinHash sketch (uint16s) and LSH band keys of each riff,
+    # all the riffs at once (None and no bands for a riff without notes)
+    events = np.concatenate(riffEvents) if len(riffEvents) else np.zeros(0, dtype=eventType)
+    riff = np.repeat(np.arange(len(riffEvents)), [len(e) for e in riffEvents])
+    on = (events['onset'] * ticksPerBeat).astype(np.int64)
+    length = (events['duration'] * ticksPerBeat).astype(np.int64)
+    trk = events['track'].astype(np.int64)
+    pitch = events['pitch'].astype(np.int64)
+    order = np.lexsort((length, pitch, on, trk, riff))
+    riff, on, length, trk, pitch = riff[order], on[order], length[order], trk[order], pitch[order]
+    bounds = np.searchsorted(riff, np.arange(len(riffEvents) + 1))
+    canonical = np.stack([trk, on, pitch, length], axis=1)
+    fingerprints = [int.from_bytes(hashlib.blake2b(canonical[a:b].tobytes(), digest_size=8).digest(), 'big', signed=True)
+                    for a, b in zip(bounds[:-1], bounds[1:])]
+
+    # every note as a number (track, pitch, length and time since the last note on the track), then every run of notes
+    newTrack = np.ones(len(on), dtype=bool)
+    newTrack[1:] = (riff[1:] != riff[:-1]) | (trk[1:] != trk[:-1])
+    since = np.diff(on, prepend=0)
+    since[newTrack] = 0
+    notes = Mix((trk << 56 | pitch << 48 | (length & 0xffffff) << 24 | (since & 0xffffff)).astype(np.uint64))
+    grams = notes[:len(notes) - ngram + 1].copy()
+    same = np.ones(len(grams), dtype=bool)            # runs can't go from one track (or riff) to the next
+    for i in range(1, ngram):
+        grams = Mix(grams ^ notes[i:len(notes) - ngram + 1 + i])
+        same &= ~newTrack[i:len(notes) - ngram + 1 + i]
+    grams, gramRiff = grams[same], riff[:len(same)][same]
+    short = np.setdiff1d(riff, gramRiff, assume_unique=False) if len(riff) else riff     # riffs with no runs use their notes
+    if len(short):
+        extra = np.isin(riff, short)
+        grams = np.concatenate([grams, notes[extra]])
+        gramRiff = np.concatenate([gramRiff, riff[extra]])
+        order = np.argsort(gramRiff, kind='stable')
+        grams, gramRiff = grams[order], gramRiff[order]
+
+    hasNotes = bounds[1:] > bounds[:-1]
+    starts = np.searchsorted(gramRiff, np.flatnonzero(hasNotes))
+    sketches = np.empty((len(starts), minHashes), dtype=np.uint64)
+    for i, seed in enumerate(minHashSeeds):
+        sketches[:, i] = np.minimum.reduceat(Mix(grams ^ seed), starts) if len(starts) else []
+    keys = np.zeros((len(starts), lshBands), dtype=np.uint64)
+    for i, column in enumerate(sketches.reshape(len(starts), lshBands, minHashes // lshBands).transpose(2, 0, 1)):
+        keys = Mix(keys ^ column ^ minHashSeeds[i])
+    keys = (keys ^ np.arange(lshBands, dtype=np.uint64)).view(np.int64)      # a different key for each band
+    results = []
+    row = 0
+    for fingerprint, notes in zip(fingerprints, hasNotes):
+        if notes:
+            results.append((fingerprint, sketches[row].astype(np.uint16), keys[row].tolist()))
+            row += 1
+        else:
+            results.append((fingerprint, None, []))
+    return results
+
+def RiffSketch(events):
+    return RiffSketches([events])[0]
+
+def Similarity(sketch, sketches):
+    # how similar a sketch is to each of a list of them (0 to 1)
+    return (np.array(sketches) == sketch).mean(axis=1)
+
+class RiffIndex:
+    # the riffs that have been written, in an SQLite file (path), see above
+    # Filter() is all that's needed, it checks a list of riffs and adds the new ones
+
+    def __init__(self, path, threshold=None):
+        import sqlite3
+        self.threshold = dedupThreshold if threshold is None else threshold
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS riffs (id INTEGER PRIMARY KEY, fingerprint INTEGER UNIQUE, sketch BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, riff INTEGER, PRIMARY KEY (band, riff)) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value)")
+        settings = {'minHashes': minHashes, 'lshBands': lshBands, 'ngram': ngram, 'ticksPerBeat': ticksPerBeat}
+        saved = dict(self.db.execute("SELECT name, value FROM settings"))
+        if saved and saved != settings:
+            raise ValueError("%s was made with different settings %s, not %s" % (path, saved, settings))
+        self.db.executemany("INSERT OR IGNORE INTO settings VALUES (?, ?)", settings.items())
+        self.db.commit()
+
+    def Lookup(self, query, values):
+        # runs a query with 'IN (%s)' for a lot of values, a few hundred at a time
+        values = list(values)
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            yield from self.db.execute(query % ",".join("?" * len(chunk)), chunk)
+
+    def Filter(self, riffs, limit=None):
+        # the riffs that aren't the same or nearly the same as one in the index (or earlier in the list),
+        # those are added to the index (only the first limit of them, the rest are left out and not added)
+        sketches = RiffSketches([riff.events for riff in riffs])
+        known = {fingerprint for fingerprint, in self.Lookup("SELECT fingerprint FROM riffs WHERE fingerprint IN (%s)",
+                                                               {sketch[0] for sketch in sketches})}
+        candidates = {}     # band key: ids of the riffs with that band
+        for band, riff in self.Lookup("SELECT band, riff FROM bands WHERE band IN (%s)",
+                                      {band for sketch in sketches for band in sketch[2]}):
+            candidates.setdefault(band, []).append(riff)
+        stored = {riff: np.frombuffer(sketch, np.uint16) for riff, sketch in self.Lookup(
+            "SELECT id, sketch FROM riffs WHERE id IN (%s)", {riff for ids in candidates.values() for riff in ids})}
+
+        nextId = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM riffs").fetchone()[0]
+        kept = []
+        rows = []
+        bandRows = []
+        for riff, (fingerprint, sketch, bands) in zip(riffs, sketches):
+            if limit is not None and len(kept) >= limit:
+                break
+            if fingerprint in known:
+                continue
+            similar = {other for band in bands for other in candidates.get(band, [])}
+            if similar and Similarity(sketch, [stored[other] for other in similar]).max() >= self.threshold:
+                continue
+            kept.append(riff)
+            known.add(fingerprint)
+            stored[nextId] = sketch
+            for band in bands:
+                candidates.setdefault(band, []).append(nextId)
+            rows.append((nextId, fingerprint, None if sketch is None else sketch.tobytes()))
+            bandRows += [(band, nextId) for band in bands]
+            nextId += 1
+        with self.db:
+            self.db.executemany("INSERT INTO riffs VALUES (?, ?, ?)", rows)
+            self.db.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?)", bandRows)
+        return kept
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM riffs").fetchone()[0]
+
+    def Close(self):
+        self.db.close()
+
+######################## RIFF CATALOGUE ########################
+# the file names only say how many bars and which chords, so finding riffs with something in common means reading
+# thousands of names, instead every riff can be recorded in a RiffCatalogue (an SQLite file) with everything about it:
+# its seed, the randomised inputs, the chords, how long it is, how many notes of each kind, how much of the riff is
+# each section (palm muting, chords, melody, rest) and how many times each palm mute pattern was played
+# the MIDI isn't kept, any riff can be written again exactly from its seed (Render()), as long as the settings
+# (tempo, key, stay/h/m/p, the chains from UseMarkov() and pmPatterns...) are the same as when it was recorded,
+# see CatalogueSettings() (the chains are checked by what's in them, not the file name, since the file can change)
+# Find() takes conditions like 'bars = 4' or 'chords <= 3', or the names of the tags below, e.g.
+# catalogue.Find('gallop-heavy', 'bars = 4', 'chords <= 3'), or from the command line see Riff_Catalogue.py
+
+catalogueTags = {
+    'gallop-heavy': 'gallopRatio >= 0.25',      # a quarter of the riff or more is gallops
+    'chuggy': 'pmRatio >= 0.5',
+    'chordy': 'chordRatio >= 0.5',
+    'melodic': 'melodyRatio >= 0.5',
+    'sparse': 'restRatio >= 0.25'}
+
+catalogueColumns = ['entropy TEXT', 'spawnKey TEXT', 'repeat INTEGER', 'part INTEGER', 'fixed TEXT',
+                    'lockstepFirst INTEGER', 'lockstepRepeats INTEGER', 'songParts INTEGER'] + \
+                   ['%s INTEGER' % name for name in randomisedInputs] + \
+                   ['tempo INTEGER', 'chordSet TEXT', 'chords INTEGER', 'bars INTEGER', 'length REAL',
+                    'notes INTEGER', 'pmNotes INTEGER', 'chordNotes INTEGER', 'melodyNotes INTEGER',
+                    'pmRatio REAL', 'chordRatio REAL', 'melodyRatio REAL', 'restRatio REAL', 'gallopRatio REAL']
+
+def RiffStats(events, patterns, length):
+    # note counts and how much of the riff (in beats) each section takes up, for the catalogue and sweep()
+    # patterns is how many times each palm mute pattern was played, length is riffLength
+    played = events[~events['pm']]
+    onsets, counts = np.unique(played['onset'], return_counts=True)
+    chord = np.isin(played['onset'], onsets[counts > 1])        # open chords are 2 notes at once, melody is 1
+    patternBeats = patterns * pmLengths
+    beats = {'pm': patternBeats.sum(), 'chord': played['duration'][chord].sum() / 2,
+             'melody': played['duration'][~chord].sum()}
+    beats['rest'] = max(length - sum(beats.values()), 0)
+    beats['gallop'] = sum(b for name, b in zip(pmNames, patternBeats) if 'Gallop' in name)
+    stats = {'notes': len(events), 'pmNotes': int(events['pm'].sum()), 'chordNotes': int(chord.sum()),
+             'melodyNotes': int((~chord).sum())}
+    stats.update({section + 'Ratio': float(b / length) for section, b in beats.items()})
+    return stats
+
+def MarkovDigest():
+    # a hash of the chains from UseMarkov() (if any) and the scales, the source can be changed without its name changing
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(markovChains or {}):
+        array = np.ascontiguousarray(markovChains[name])
+        digest.update(("%s %s %s;" % (name, array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    digest.update(repr((list(keyScale), list(keyHarmony3), list(keyHarmony7))).encode())
+    return digest.hexdigest()
+
+def CatalogueSettings():
+    # everything besides the seed that changes which riffs get written (or their MIDI)
+    return {'tempo': tempo, 'key': key, 'djent': djent, 'chordPick': chordPick, 'riffLengthMin': riffLengthMin,
+            'riffLengthMed': riffLengthMed, 'riffLengthMax': riffLengthMax, 'channel': channel, 'track': track,
+            'PMtrack': PMtrack, 'ticksPerBeat': ticksPerBeat, 'stay': stay, 'h': h, 'm': m, 'p': p,
+            'pPM': pPM, 'pCH': pCH, 'pN': pN, 'highestNotes': repr(list(highestNotes)), 'mostChords': mostChords,
+            'markov': MarkovDigest(), 'pmPatterns': repr(pmPatterns)}
+
+class RiffCatalogue:
+    # every riff that's been recorded, in an SQLite file (path), see above
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS riffs (id INTEGER PRIMARY KEY, %s)" % ", ".join(catalogueColumns))
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value)")
+        columns = [row['name'] for row in self.db.execute("PRAGMA table_info(riffs)")]
+        for name in pmNames:        # a column for each palm mute pattern, new patterns get new columns
+            if name not in columns:
+                self.db.execute('ALTER TABLE riffs ADD COLUMN "%s" INTEGER DEFAULT 0' % name)
+        self.columns = [row['name'] for row in self.db.execute("PRAGMA table_info(riffs)")]
+        self.db.commit()
+
+    def CheckSettings(self):
+        settings = CatalogueSettings()
+        saved = {row['name']: row['value'] for row in self.db.execute("SELECT name, value FROM settings")}
+        if saved and saved != settings:
+            changed = sorted(name for name in settings if saved.get(name) != settings[name])
+            raise ValueError("%s was recorded with different settings (%s)" % (self.path, ", ".join(changed)))
+        if not saved:
+            with self.db:
+                self.db.executemany("INSERT INTO settings VALUES (?, ?)", settings.items())
+
+    def Add(self, riffs):
+        # records a list of riffs (from generate_batch(), iter_riffs()...) in one transaction, returns their ids
+        import json
+        self.CheckSettings()
+        names = [column.split()[0] for column in catalogueColumns] + pmNames
+        rows = []
+        for riff in riffs:
+            inputs = riff.inputs
+            lockstep = riff.lockstep or (None, None, None)
+            row = [json.dumps(riff.seed.entropy), json.dumps(list(riff.seed.spawn_key)), riff.repeat, riff.part,
+                   json.dumps({name: value.item() if isinstance(value, np.generic) else value
+                               for name, value in (riff.fixed or {}).items()}), lockstep[0], lockstep[1], lockstep[2]]
+            row += [inputs[name] for name in randomisedInputs]
+            row += [inputs['tempo'], ",".join(riff.chords), len(riff.chords), riff.bars, riff.length]
+            row += RiffStats(riff.events, riff.patterns, riff.length).values()
+            rows.append(row + riff.patterns.tolist())
+        with self.db:
+            first = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM riffs").fetchone()[0]
+            self.db.executemany('INSERT INTO riffs (%s) VALUES (%s)' % (
+                ", ".join('"%s"' % name for name in names), ", ".join("?" * len(names))), rows)
+        return list(range(first, first + len(rows)))
+
+    def Condition(self, condition):
+        # one of the tags, or 'column op value', as SQL (the column has to be one of the catalogue's)
+        condition = catalogueTags.get(condition, condition)
+        for op in ['<=', '>=', '!=', '=', '<', '>']:
+            column, found, value = (part.strip() for part in condition.partition(op))
+            if found:
+                break
+        else:
+            raise ValueError("%r is not a tag (%s) or a condition like 'bars = 4'" % (condition, ", ".join(catalogueTags)))
+        if column not in self.columns:
+            raise ValueError("%r is not a column of the catalogue, use one of %s" % (column, ", ".join(self.columns)))
+        return '"%s" %s ?' % (column, op), value
+
+    def Find(self, *conditions, limit=None):
+        # the riffs (as sqlite3.Rows, like dicts) that meet every condition, oldest first
+        where = [self.Condition(condition) for condition in conditions]
+        query = "SELECT * FROM riffs"
+        if where:
+            query += " WHERE " + " AND ".join(sql for sql, value in where)
+        query += " ORDER BY id"
+        if limit is not None:
+            query += " LIMIT %d" % limit
+        return self.db.execute(query, [value for sql, value in where]).fetchall()
+
+    def Render(self, id, backend=None):
+        # writes the riff again from its seed, returns the Riff (riff.midi is the MIDI file)
+        import json
+        self.CheckSettings()
+        row = self.db.execute("SELECT * FROM riffs WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            raise KeyError("there is no riff %r in %s" % (id, self.path))
+        entropy, spawnKey = json.loads(row['entropy']), tuple(json.loads(row['spawnKey']))
+        fixed = json.loads(row['fixed']) or None
+        if row['lockstepFirst'] is None:
+            seed = np.random.SeedSequence(entropy, spawn_key=spawnKey)
+            return GenerateRepeat(seed, row['repeat'], row['part'] + 1, backend, fixed)[row['part']]
+        # a lockstep riff depends on every repeat it was written with, so they're all written again
+        # (their seeds are the children either side of this one)
+        offset = row['repeat'] - row['lockstepFirst']
+        seeds = [np.random.SeedSequence(entropy, spawn_key=spawnKey[:-1] + (spawnKey[-1] - offset + i,))
+                 for i in range(row['lockstepRepeats'])]
+        riffs = GenerateLockstep(seeds, row['lockstepFirst'], row['songParts'], backend, fixed)
+        return riffs[offset * row['songParts'] + row['part']]
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM riffs").fetchone()[0]
+
+    def Close(self):
+        self.db.close()
+
+######################## EVENT STORE ########################
+# millions of tiny MIDI files are slow to write, list and read back, so riffs can be kept in an EventStore instead:
+# a folder of columns (riff, track, pitch, onset, duration, velocity, pm), one file per column per chunk, each a plain
+# array of fixed width values (see storeTypes) that riffs are appended to, and an index with where each riff starts
+# reading is np.memmap, so nothing is read until it's used and Columns() are views straight onto the files
+# Events() puts one riff back together as an eventType array, MIDI() writes it as a MIDI file
+# generate_batch(out=folder, format='events') writes a batch to one, or Append() a list of riffs (or event arrays)
+# riffs are numbered in the order they're added, a riff is never split between chunks
+# only one process should append to a store at a time
+
+storeChunkEvents = 1 << 22      # a new chunk is started when one gets to this many events (about 100 MB)
+storeTypes = {'riff': np.dtype(np.uint32), **{name: eventType[name] for name in eventType.names}}
+indexType = np.dtype([('chunk', np.uint32), ('start', np.uint64), ('count', np.uint32)])
+
+class EventStore:
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.maps = {}          # the memmaps of each chunk's columns, opened when they're first read
+        self.index = self.ReadIndex()
+
+    def File(self, column, chunk):
+        return os.path.join(self.path, "%s.%06d" % (column, chunk))
+
+    def ReadIndex(self):
+        name = os.path.join(self.path, 'index')
+        riffs = os.path.getsize(name) // indexType.itemsize if os.path.exists(name) else 0
+        return np.memmap(name, indexType, 'r', shape=(riffs,)) if riffs else np.zeros(0, indexType)
+
+    def Append(self, riffs):
+        # adds riffs (Riffs or eventType arrays) to the end of the store, returns their numbers
+        events = [riff if isinstance(riff, np.ndarray) else riff.events for riff in riffs]
+        first = len(self.index)
+        rows = np.zeros(len(events), indexType)
+        if first:
+            chunk, end = int(self.index[-1]['chunk']), int(self.index[-1]['start'] + self.index[-1]['count'])
+        else:
+            chunk, end = 0, 0
+        for i, riffEvents in enumerate(events):
+            if end and end + len(riffEvents) > storeChunkEvents:
+                chunk, end = chunk + 1, 0
+            rows[i] = (chunk, end, len(riffEvents))
+            end += len(riffEvents)
+        for chunk in np.unique(rows['chunk']):
+            inChunk = np.flatnonzero(rows['chunk'] == chunk)
+            columns = np.concatenate([events[i] for i in inChunk]) if len(inChunk) else np.zeros(0, eventType)
+            riff = np.repeat(first + inChunk, rows['count'][inChunk]).astype(storeTypes['riff'])
+            for column in storeTypes:
+                with open(self.File(column, chunk), 'ab') as out:
+                    out.write(riff.tobytes() if column == 'riff' else np.ascontiguousarray(columns[column]).tobytes())
+            self.maps.pop(int(chunk), None)     # it's longer now
+        with open(os.path.join(self.path, 'index'), 'ab') as out:     # last, so a riff is only there once it's all written
+            out.write(rows.tobytes())
+        self.index = self.ReadIndex()
+        return list(range(first, first + len(rows)))
+
+    def Chunk(self, chunk):
+        # every column of a chunk, as memmaps (for reading lots of riffs at once)
+        if chunk not in self.maps:
+            self.maps[chunk] = {column: np.memmap(self.File(column, chunk), dtype, 'r')
+                                if os.path.getsize(self.File(column, chunk)) else np.zeros(0, dtype)
+                                for column, dtype in storeTypes.items()}
+        return self.maps[chunk]
+
+    def Columns(self, riff):
+        # one riff's columns, views of the files (nothing is copied)
+        chunk, start, count = self.index[riff].tolist()
+        if count == 0:
+            return {column: np.zeros(0, dtype) for column, dtype in storeTypes.items()}
+        return {column: values[start:start + count] for column, values in self.Chunk(chunk).items()}
+
+    def Events(self, riff):
+        columns = self.Columns(riff)
+        events = np.zeros(len(columns['riff']), eventType)
+        for name in eventType.names:
+            events[name] = columns[name]
+        return events
+
+    def MIDI(self, riff, trackNames=None, backend=None):
+        return RenderMIDI(self.Events(riff), trackNames, backend)
+
+    def __len__(self):
+        return len(self.index)
+
+######################## LOCKSTEP ENGINE ########################
+# RiffGenerator() writes one riff at a time, one pass of the while loop at a time, which is slow for lots of riffs
+# LockstepRiffs() runs the same loop for a whole batch of riffs at once: every riff's chord, note, note length, time
+# and stickiness is one entry of an array, each pass draws all of the random numbers for every riff in one go,
+# each section is done for all the riffs that picked it with array maths, and riffs drop out when they're long enough
+# the odds of everything are the same as RiffGenerator() (sections, stickiness, note lengths, cutting off overruns),
+# but each decision has its own column of random numbers, so for a seed they're not the same riffs RiffGenerator() writes
+# (the inputs, chords and riff lengths are the same, they're set up by SetupRepeat(), same as GenerateRepeat())
+
+lockstepRepeats = 1000      # repeats written together by one LockstepRiffs(), generate_batch() splits the work up by these
+
+def LockstepRiffs(sessions, songParts, rng):
+    # songParts riffs for each session (set up with SetupRepeat()), all written at once, returns the events of every riff
+    # (riffs are in order, songParts riffs for the first session, then the next...) and how many times each one
+    # played each palm mute pattern (a row per riff)
+    riffs = len(sessions) * songParts
+    group = np.repeat(np.arange(len(sessions)), songParts)         # which session each riff belongs to
+    howMuch = np.array([[s.howMuchPM, s.howMuchCHORDS, s.howMuchMELODY, s.howMuchREST] for s in sessions], dtype=float)
+    pm, ch, ml, rs = (howMuch / howMuch.sum(axis=1, keepdims=True))[group].T
+    riffLength = np.array([s.riffLength for s in sessions], dtype=float)[group]
+
+    # every session's chord transfer function in one array, padded with cdf = 1 so the padding is never drawn
+    width = max(len(s.ctNotes) for s in sessions)
+    ctNotes = np.zeros((len(sessions), width), dtype=int)
+    ctCDF = np.ones((len(sessions), width, width))
+    for i, s in enumerate(sessions):
+        ctNotes[i, :len(s.ctNotes)] = s.ctNotes
+        ctCDF[i, :len(s.ctNotes), :len(s.ctNotes)] = s.ctCDF
+    # and the melody transfer functions, one for each highestNote and howMuchCrazy in the batch
+    tables = {}
+    melody = np.array([tables.setdefault((s.highestNote, s.howMuchCrazy), len(tables)) for s in sessions])[group]
+    width = len(keyScale)
+    mtNotes = np.zeros((len(tables), width), dtype=int)
+    mtCDF = np.ones((len(tables), width, width))
+    mtIndex = np.zeros((len(tables), keyScale[-1] + 1), dtype=int)
+    for (highestNote, howMuchCrazy), i in tables.items():
+        notes, cdf, index, mtf = CompiledMelodyTransferFunction(highestNote, howMuchCrazy)
+        mtNotes[i, :len(notes)] = notes
+        mtCDF[i, :len(notes), :len(notes)] = cdf
+        mtIndex[i] = index
+
+    # the state of every riff, same starting values as RiffGenerator()
+    time = np.zeros(riffs)
+    currentChord = np.zeros(riffs, dtype=int)
+    currentNote = np.zeros(riffs, dtype=int)
+    currentNoteLength = np.full(riffs, 1/2)
+    pmCURRENT = np.ones(riffs)
+    chCURRENT = np.ones(riffs)
+    mlCURRENT = np.ones(riffs)
+
+    # chords and notes: (riff, note, onset, length), palm muting: (riff, pattern, onset, note, interval), one array per pass
+    notes = []
+    palmMutes = []
+    fullPatterns, fullCDF = pmChoices[1]
+    shortPatterns, shortCDF = pmChoices[1/2]
+    pmChord = pmNames.index('PMChordSHORT')
+
+    live = np.arange(riffs)          # the riffs that aren't long enough yet
+    while len(live):
+        (uChord, uPM, uPMNote, uPattern, uCH, uLength1, uLength2, uLength3, uInterval, uPMChord,
+         uML, uChordNote, uLonger, uShorter, uMelody, uRS, uRest) = rng.random((17, len(live)))
+
+        # markov chain to change chord (same as Draw(), searchsorted is the number of cdf values <= the random number)
+        g = group[live]
+        currentChord[live] = (ctCDF[g, currentChord[live]] <= uChord[:, None]).sum(axis=1)
+        chordNote = ctNotes[g, currentChord[live]]
+        t = np.floor(time[live] * 2) / 2           # correct rounding errors in time, only 1/8 notes
+
+        isPM = uPM < pm[live] * pmCURRENT[live]
+        isCH = ~isPM & (uCH < ch[live] * chCURRENT[live])
+        isML = ~isPM & ~isCH & (uML < ml[live] * mlCURRENT[live])
+        isRS = ~isPM & ~isCH & ~isML & (uRS < rs[live])
+
+        # palm muting
+        r = live[isPM]
+        short = t[isPM] % 1 != 0
+        patterns = np.where(short, shortPatterns[shortCDF.searchsorted(uPattern[isPM], side='right')],
+                            fullPatterns[fullCDF.searchsorted(uPattern[isPM], side='right')])
+        palmMutes.append((r, patterns, t[isPM], np.where(uPMNote[isPM] > pPM, chordNote[isPM], 0), np.full(len(r), 7)))
+        t[isPM] += pmLengths[patterns]
+        pmCURRENT[r], chCURRENT[r], mlCURRENT[r] = 2, 1, 1
+
+        # chords
+        r = live[isCH]
+        length = np.select([uLength1[isCH] < pCH, uLength2[isCH] < pCH, uLength3[isCH] < pCH / 2], [1/2, 3/2, 2], 1)
+        length = np.minimum(length, riffLength[r] - t[isCH])       # check how long is left, and correct to avoid overruns
+        interval = np.where(uInterval[isCH] < pCH, 3, 7)
+        pmChords = uPMChord[isCH] < pCH         # 1 PM chord, or 2 if the chord is at least a beat, then nothing
+        two = pmChords & (length >= 1)
+        palmMutes.append((r[pmChords], np.full(np.count_nonzero(pmChords), pmChord), t[isCH][pmChords],
+                          chordNote[isCH][pmChords], interval[pmChords]))
+        palmMutes.append((r[two], np.full(np.count_nonzero(two), pmChord), t[isCH][two] + 1/2,
+                          chordNote[isCH][two], interval[two]))
+        chords = ~pmChords
+        notes.append((r[chords], chordNote[isCH][chords], t[isCH][chords], length[chords]))
+        notes.append((r[chords], Harmonies(chordNote[isCH][chords], interval[chords]), t[isCH][chords], length[chords]))
+        t[isCH] += length
+        currentNoteLength[r] = length
+        pmCURRENT[r], chCURRENT[r], mlCURRENT[r] = 1, 2, 1
+
+        # melody
+        r = live[isML]
+        note = np.where(uChordNote[isML] < pN, chordNote[isML], currentNote[r])
+        length = currentNoteLength[r]
+        length = np.where(uLonger[isML] < pN, length * 2, np.where(uShorter[isML] < pN * 2, length / 2, length))
+        length = np.where((length > 2) | (length < 1/2), 1, length)          # make sure note lengths are not stupid
+        length = np.minimum(length, riffLength[r] - t[isML])
+        table = melody[r]
+        rows = mtCDF[table, mtIndex[table, note]]
+        currentNote[r] = mtNotes[table, (rows <= uMelody[isML][:, None]).sum(axis=1)]
+        notes.append((r, currentNote[r], t[isML], length))
+        t[isML] += length
+        currentNoteLength[r] = length
+        pmCURRENT[r], chCURRENT[r], mlCURRENT[r] = 1, 1, 4
+
+        # rest
+        r = live[isRS]
+        t[isRS] += np.where(uRest[isRS] < 0.5, 1/2, 1)
+        pmCURRENT[r], chCURRENT[r], mlCURRENT[r] = 1, 1, 1
+
+        time[live] = t
+        live = live[t < riffLength[live]]
+
+    # the events of every riff, in the same order as RiffSession.Events(): chords and notes, then palm muting, by onset
+    noteRiff, notePitch, noteOnset, noteLength = (np.concatenate(column) for column in zip(*notes))
+    pmRiff, pmPattern, pmOnset, pmNote, pmInterval = (np.concatenate(column) for column in zip(*palmMutes))
+    played = np.zeros(len(noteRiff), dtype=eventType)
+    played['track'] = track
+    played['pitch'] = key + notePitch
+    played['onset'] = noteOnset
+    played['duration'] = noteLength
+    played['velocity'] = chordPick
+    events = np.concatenate([played, PalmMuteEvents(pmPattern, pmOnset, pmNote, pmInterval)])
+    riffOf = np.concatenate([noteRiff, np.repeat(pmRiff, pmCounts[pmPattern])])
+    order = np.lexsort((events['onset'], riffOf))
+    events = events[order]
+    bounds = np.searchsorted(riffOf[order], np.arange(riffs + 1))
+    patterns = np.zeros((riffs, len(pmNames)), dtype=int)
+    np.add.at(patterns, (pmRiff, pmPattern), 1)
+    return [events[start:end] for start, end in zip(bounds[:-1], bounds[1:])], patterns
+
+def GenerateLockstep(seeds, firstRepeat, songParts, backend=None, inputs=None):
+    # the repeats for a list of seeds (like GenerateRepeat() for each one), with the riffs written by LockstepRiffs()
+    # the random numbers for the riffs come from a child of the first seed, so they only depend on the seeds
+    sessions = [RiffSession(seed).SetupRepeat(inputs) for seed in seeds]
+    rng = np.random.default_rng(np.random.SeedSequence(seeds[0].entropy, spawn_key=seeds[0].spawn_key + (0,)))
+    riffs = []
+    written, patterns = LockstepRiffs(sessions, songParts, rng)
+    for i, events in enumerate(written):
+        session = sessions[i // songParts]
+        riffs.append(Riff(RenderMIDI(events, backend=backend), list(session.chordsInKey), int(session.riffLength / 4),
+                          session.RandomisedInputs(), firstRepeat + i // songParts, i % songParts, events,
+                          session.riffLength, seeds[i // songParts], inputs, (firstRepeat, len(seeds), songParts),
+                          patterns[i]))
+    return riffs
+
+######################## STREAMING ########################
+# iter_riffs() writes riffs as they're asked for instead of all at once, one repeat at a time, so it never holds more
+# than one repeat's riffs in memory and can run forever (n=None)
+# the riffs are the same ones generate_batch() writes for the same seed (repeat i uses the seed's i-th child)
+# params are the same as generate_batch(): songParts, backend, and inputs (randomised inputs to fix)
+
+def StreamParams(params):
+    params = dict(params or {})
+    songParts = params.pop('songParts', 3)
+    backend = params.pop('backend', None)
+    inputs = params.pop('inputs', {})
+    if params:
+        raise ValueError("unknown params %s, use songParts, backend or inputs" % sorted(params))
+    return songParts, backend, inputs
+
+def iter_riffs(params=None, seed=None, n=None):
+    # yields n riffs (forever if n is None)
+    songParts, backend, inputs = StreamParams(params)
+    seeds = np.random.SeedSequence(seed)
+    count = 0
+    repeat = 0
+    while n is None or count < n:
+        for riff in GenerateRepeat(seeds.spawn(1)[0], repeat, songParts, backend, inputs):
+            if n is not None and count >= n:
+                return
+            yield riff
+            count += 1
+        repeat += 1
+
+async def aiter_riffs(params=None, seed=None, n=None, executor=None, prefetch=2):
+    # same as iter_riffs(), for async for, the riffs are written in executor (None is asyncio's default thread pool,
+    # or pass a process pool, WorkerPool(n) so the workers get the same settings) so the event loop keeps running
+    # only prefetch repeats are written ahead of the consumer, so a slow consumer slows the writing down (backpressure)
+    songParts, backend, inputs = StreamParams(params)
+    import asyncio
+    loop = asyncio.get_running_loop()
+    seeds = np.random.SeedSequence(seed)
+    pending = deque()
+    count = 0
+    repeat = 0
+    try:
+        while n is None or count < n:
+            while len(pending) < max(prefetch, 1) and (n is None or repeat * songParts < n):
+                pending.append(loop.run_in_executor(executor, GenerateRepeat, seeds.spawn(1)[0], repeat, songParts,
+                                                    backend, inputs))
+                repeat += 1
+            for riff in await pending.popleft():
+                if n is not None and count >= n:
+                    return
+                yield riff
+                count += 1
+    finally:
+        for future in pending:
+            future.cancel()
+
+######################## PARAMETER SWEEP ########################
+# I never tuned the probabilities because it was too hard to test, sweep() maps the inputs to what the riffs come out like
+# design is a grid, {'howMuchPM': [3, 5, 8], 'pCH': [0.1, 0.2]} (every combination), or a list of points, e.g. from
+# RandomDesign(), and any of the randomised inputs or sweepSettings can be in it (anything left out is random as usual)
+# k riffs are written at every point, spread over every core, without writing any MIDI, and each point gets a row of
+# averages: notes per beat, pitch range, how much of the riff is each section, chord changes per bar,
+# and how long RiffGenerator() took (the mean and 90th percentile, in microseconds)
+# the results are a pandas DataFrame (saved as CSV if out is given), the same seed gives the same table
+# the settings are changed in whichever process writes the riffs (and put back after), so don't run one in a thread
+
+sweepSettings = ['stay', 'h', 'm', 'p', 'pPM', 'pCH', 'pN']
+sweepBlock = 50             # riffs written together by one job
+sweepColumns = ['notesPerBeat', 'pitchRange', 'pmRatio', 'chordRatio', 'melodyRatio', 'restRatio', 'gallopRatio',
+                'chordChangesPerBar', 'microseconds']
+
+def RandomDesign(ranges, n, seed=None):
+    # n points picked at random from ranges {name: (low, high)}, ints for ints (high included), floats for floats
+    rng = np.random.default_rng(seed)
+    columns = {name: rng.integers(low, high + 1, n).tolist() if isinstance(low, int) and isinstance(high, int)
+               else rng.uniform(low, high, n).tolist() for name, (low, high) in ranges.items()}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def ChordChanges(events):
+    # how many times the chord changes, going by the lowest note of every chord (open or palm muted)
+    onsets, first, counts = np.unique(events['onset'], return_index=True, return_counts=True)
+    if len(onsets) == 0:
+        return 0
+    roots = np.minimum.reduceat(events['pitch'], first)[counts > 1]
+    return int(np.count_nonzero(np.diff(roots.astype(int))))
+
+def SweepJob(point, seed, k):
+    # k riffs at one point, a row of numbers (see sweepColumns) for each riff
+    inputs = {name: value for name, value in point.items() if name in randomisedInputs}
+    settings = {name: value for name, value in point.items() if name in sweepSettings}
+    saved = {name: globals()[name] for name in settings}
+    globals().update(settings)
+    transfers = any(name in settings for name in ['stay', 'h', 'm', 'p'])
+    if transfers:
+        ClearCache()
+    try:
+        session = RiffSession(seed)
+        rows = np.zeros((k, len(sweepColumns)))
+        for i in range(k):
+            session.SetupRepeat(inputs)
+            start = perf_counter()
+            session.RiffGenerator()
+            events = session.Events()
+            seconds = perf_counter() - start
+            stats = RiffStats(events, np.bincount(np.array(session.pmPattern, dtype=int), minlength=len(pmNames)),
+                              session.riffLength)
+            pitches = events['pitch'].astype(int)
+            rows[i] = [len(events) / session.riffLength, np.ptp(pitches) if len(pitches) else 0,
+                       stats['pmRatio'], stats['chordRatio'], stats['melodyRatio'], stats['restRatio'],
+                       stats['gallopRatio'], ChordChanges(events) / (session.riffLength / 4), seconds * 1e6]
+        return rows
+    finally:
+        globals().update(saved)
+        if transfers:
+            ClearCache()
+
+def sweep(design, k=100, workers=None, seed=None, out=None):
+    points = [dict(zip(design, values)) for values in product(*design.values())] if isinstance(design, dict) else list(design)
+    for point in points:
+        unknown = sorted(set(point) - set(randomisedInputs) - set(sweepSettings))
+        if unknown:
+            raise ValueError("can't sweep %s, only %s" % (unknown, randomisedInputs + sweepSettings))
+    blocks = [min(sweepBlock, k - start) for start in range(0, k, sweepBlock)]
+    jobs = [(point, child, size) for point, pointSeed in zip(points, np.random.SeedSequence(seed).spawn(len(points)))
+            for child, size in zip(pointSeed.spawn(len(blocks)), blocks)]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        results = [SweepJob(*job) for job in jobs]
+    else:
+        with WorkerPool(workers) as pool:          # the workers start with this process's settings
+            results = list(pool.map(SweepJob, *zip(*jobs), chunksize=max(1, len(jobs) // (workers * 4))))
+
+    import pandas as pd
+    table = []
+    for i, point in enumerate(points):
+        rows = np.concatenate(results[i * len(blocks):(i + 1) * len(blocks)])
+        summary = dict(point, riffs=len(rows))
+        summary.update(zip(sweepColumns[:-1], rows[:, :-1].mean(axis=0).tolist()))
+        summary['microseconds'] = float(rows[:, -1].mean())
+        summary['p90Microseconds'] = float(np.percentile(rows[:, -1], 90))
+        table.append(summary)
+    table = pd.DataFrame(table)
+    if out is not None:
+        table.to_csv(out, index=False)
+    return table
 
 # run the main function       
 if __name__ == "__main__":